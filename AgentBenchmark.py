@@ -0,0 +1,180 @@
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import tempfile
+import numpy as np
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None # Python 2 without the pytracemalloc backport, see result_bytes
+
+from DQNAgent import ReplayMemory
+
+STATE_SHAPE = (4, 2)
+NB_ACTIONS  = 25
+
+class SyntheticEnvironment(object):
+    """
+    In-memory stand-in for EnvironmentSeq: (2,) states, 25 actions, random rewards and fixed length
+    episodes, no disk, AirSim or detector involved
+    """
+    def __init__(self, state_dims=STATE_SHAPE[1], episode_length=100, seed=0):
+        self.state_dims     = state_dims
+        self.episode_length = episode_length
+        self.random         = np.random.RandomState(seed)
+        self.states         = self.random.uniform(-0.1, 0.1, (4096, state_dims)).astype(np.float32)
+        self.rewards        = self.random.uniform(0.0, 1.0, 4096).astype(np.float32)
+        self.t              = 0
+        self.steps          = 0
+
+    def reset(self):
+        self.steps = 0
+        return self.step(None)[0]
+
+    def step(self, action):
+        self.t     = (self.t + 1) % len(self.states)
+        self.steps += 1
+        return self.states[self.t], float(self.rewards[self.t]), int(self.steps >= self.episode_length)
+
+def result_bytes(value):
+    ''' Approximate bytes of what a call returns (arrays, nested tuples / lists / dicts, Python scalars), the
+    allocations of a ReplayMemory or agent call are dominated by its output
+    '''
+    if value is None:
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes if value.base is None else 0 # Views allocate no data
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(result_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(result_bytes(item) for item in value.values())
+    return sys.getsizeof(value)
+
+def measure(fn, min_time=1.0, min_ops=10):
+    ''' Call fn until min_time seconds and min_ops calls have passed.
+    Returns (ops/sec, bytes allocated by one call): the traced peak of a separate untimed call with tracemalloc,
+    otherwise (Python 2) the size of the arrays it returns.
+    '''
+    allocated = result_bytes(fn()) # Warm up
+
+    ops, start = 0, time.time()
+    while ops < min_ops or time.time() - start < min_time:
+        fn()
+        ops += 1
+    elapsed = time.time() - start
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+        fn()
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return ops / elapsed, allocated
+
+def fill(memory, env, count):
+    state = env.reset()
+    for _ in range(count):
+        action = random.randrange(NB_ACTIONS)
+        new_state, reward, done = env.step(action)
+        memory.append(state, action, reward, done)
+        state = env.reset() if done else new_state
+
+def bench_memory(memory_sizes, batch_sizes, min_time):
+    ''' ReplayMemory.append / sample / minibatch, numpy only
+    '''
+    rows = []
+    for size in memory_sizes:
+        env    = SyntheticEnvironment()
+        memory = ReplayMemory(size, STATE_SHAPE[1:], STATE_SHAPE[0])
+        fill(memory, env, size)
+
+        state = env.reset()
+        rows.append(('ReplayMemory.append', {'memory': size}) +
+                    measure(lambda: memory.append(state, 0, 0.0, 0), min_time))
+        for batch in batch_sizes:
+            rows.append(('ReplayMemory.sample', {'memory': size, 'batch': batch}) +
+                        measure(lambda: memory.sample(batch), min_time))
+            rows.append(('ReplayMemory.minibatch', {'memory': size, 'batch': batch}) +
+                        measure(lambda: memory.minibatch(batch), min_time))
+    return rows
+
+def bench_agent(memory_sizes, batch_sizes, min_time):
+    ''' DeepQAgent act, act + observe and train_network against the synthetic environment at every memory size
+    (needs TF and keras)
+    '''
+    from keras import backend as K
+    from DQNAgent import DeepQAgent
+
+    rows = []
+    for size in memory_sizes:
+        tmp = tempfile.mkdtemp()
+        DeepQAgent.SAVE_NETWORK_PATH = tmp
+        DeepQAgent.SAVE_SUMMARY_PATH = tmp
+        DeepQAgent.MEMORY_SIZE       = size
+        agent = DeepQAgent(STATE_SHAPE, NB_ACTIONS)
+        env   = SyntheticEnvironment()
+
+        # Past the random phase, so act() runs the forward pass
+        fill(agent._memory, env, size)
+        agent.t = agent.INITIAL_REPLAY_SIZE
+
+        state = env.reset()
+        rows.append(('DeepQAgent.act', {'memory': size}) + measure(lambda: agent.act(state), min_time))
+
+        # observe() reuses the Q-values act() computed for the same step, so one environment step is timed as a whole
+        current = [env.reset()]
+        def step():
+            action = agent.act(current[0])
+            new_state, reward, done = env.step(action)
+            agent.observe(current[0], action, reward, done)
+            current[0] = env.reset() if done else new_state
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w') # Episode summaries
+        try:
+            rows.append(('DeepQAgent.act+observe', {'memory': size}) + measure(step, min_time))
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+        agent.PREFETCH = False
+        for batch in batch_sizes:
+            agent.BATCH_SIZE = batch
+            rows.append(('DeepQAgent.train_network', {'memory': size, 'batch': batch}) +
+                        measure(agent.train_network, min_time))
+        agent.close()
+        agent.sess.close()
+        K.clear_session() # Next agent in a fresh graph
+    return rows
+
+def report(rows):
+    print "%-28s %-24s %12s %12s %12s" % ('BENCHMARK', 'PARAMS', 'OPS/SEC', 'US/OP', 'ALLOC KIB')
+    for name, params, ops, allocated in rows:
+        print "%-28s %-24s %12.1f %12.1f %12s" % (name, ' '.join('%s=%s' % item for item in sorted(params.items())),
+                                                  ops, 1e6 / ops, '-' if allocated is None else '%.2f' % (allocated / 1024.0))
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Headless micro-benchmarks of the replay memory and the agent')
+    parser.add_argument('--memory-sizes', type=int, nargs='+', default=[10000, 40000, 200000])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[32, 64, 256])
+    parser.add_argument('--min-time', type=float, default=1.0, help='Seconds per measurement')
+    parser.add_argument('--no-agent', action='store_true', help='Skip the TF benchmarks')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    random.seed(0)
+    np.random.seed(0)
+    rows = bench_memory(args.memory_sizes, args.batch_sizes, args.min_time)
+    if not args.no_agent:
+        try:
+            rows += bench_agent(args.memory_sizes, args.batch_sizes, args.min_time)
+        except ImportError as e:
+            print "Agent benchmarks unavailable:", e
+    report(rows)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([{'name': name, 'params': params, 'ops_per_sec': ops, 'allocated_bytes': allocated}
+                       for name, params, ops, allocated in rows], f, indent=2)
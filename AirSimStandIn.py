@@ -0,0 +1,361 @@
+import os
+import math
+import time
+import random
+import argparse
+import threading
+import numpy as np
+
+# msgpack-rpc (the transport of AirSimClient) is only needed to actually serve, see serve()
+
+def vector(x=0.0, y=0.0, z=0.0):
+    return {'x_val': float(x), 'y_val': float(y), 'z_val': float(z)}
+
+def quaternion(pitch=0.0, roll=0.0, yaw=0.0):
+    ''' Same convention as AirSimClient.toQuaternion
+    '''
+    t0, t1 = math.cos(yaw * 0.5), math.sin(yaw * 0.5)
+    t2, t3 = math.cos(roll * 0.5), math.sin(roll * 0.5)
+    t4, t5 = math.cos(pitch * 0.5), math.sin(pitch * 0.5)
+    return {'w_val': t0 * t2 * t4 + t1 * t3 * t5,
+            'x_val': t0 * t3 * t4 - t1 * t2 * t5,
+            'y_val': t0 * t2 * t5 + t1 * t3 * t4,
+            'z_val': t1 * t2 * t4 - t0 * t3 * t5}
+
+def plain(value):
+    ''' NumPy scalars and arrays nested in a result as Python types, msgpack-rpc only packs those
+    '''
+    if isinstance(value, dict):
+        return dict((key, plain(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    return value
+
+class Drone(object):
+    """
+    Point mass multirotor (NED frame, z down) following velocity or position commands with a first order lag
+    """
+    TAU       = 0.3  # Seconds for the velocity to respond to a command
+    TAKEOFF_Z = -3.0
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.position = np.zeros(3)
+        self.velocity = np.zeros(3)
+        self.attitude = np.zeros(3) # pitch, roll, yaw
+        self.command  = ('hover', None, None, None)
+
+    def step(self, dt, now):
+        mode, target, speed, until = self.command
+        if until is not None and now >= until:
+            self.command = mode, target, speed, until = ('hover', None, None, None)
+
+        wanted = np.zeros(3)
+        if mode == 'velocity':
+            wanted = target.copy()
+        elif mode == 'velocityz':
+            wanted = np.array([target[0], target[1], (target[2] - self.position[2]) / self.TAU])
+        elif mode == 'position':
+            offset   = target - self.position
+            distance = np.linalg.norm(offset)
+            if distance > 1e-6:
+                wanted = offset / distance * min(speed, distance / self.TAU)
+
+        self.velocity += (wanted - self.velocity) * min(1.0, dt / self.TAU)
+        self.position += self.velocity * dt
+
+class Car(object):
+    """
+    Kinematic bicycle driven by throttle / brake / steering
+    """
+    ACCELERATION = 4.0  # m/s^2 at full throttle
+    BRAKING      = 8.0  # m/s^2 at full brake
+    DRAG         = 0.05 # 1/s
+    MAX_STEERING = 0.6  # rad at steering 1
+    WHEELBASE    = 2.7
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.position = np.zeros(3)
+        self.heading  = 0.0
+        self.speed    = 0.0
+        self.controls = {'throttle': 0.0, 'brake': 0.0, 'steering': 0.0}
+
+    def step(self, dt):
+        accel = self.controls.get('throttle', 0.0) * self.ACCELERATION - self.DRAG * self.speed
+        if self.controls.get('brake', 0.0):
+            accel -= self.controls['brake'] * self.BRAKING
+        self.speed    = max(0.0, self.speed + accel * dt)
+        self.heading += self.speed * math.tan(self.controls.get('steering', 0.0) * self.MAX_STEERING) / self.WHEELBASE * dt
+        self.position += self.speed * dt * np.array([math.cos(self.heading), math.sin(self.heading), 0.0])
+
+    @property
+    def velocity(self):
+        return self.speed * np.array([math.cos(self.heading), math.sin(self.heading), 0.0])
+
+
+class StandInSim(object):
+    """
+    Stand-in for the AirSim RPC server: one multirotor and one car in the same world, the subset of the
+    MultirotorClient / CarClient API used in this repository, point mass kinematics and synthetic (or recorded)
+    downward camera frames. Methods are named after the RPC calls and return what AirSim puts on the wire
+    (msgpack-able dicts), so serve() can expose an instance directly.
+
+    The clock follows the wall clock while running, simPause(True) freezes it and simContinueForTime advances
+    it by exactly the requested time without waiting, which is what lockstep training relies on.
+    """
+    PHYSICS_DT = 0.01
+    CAR_SIZE   = (4.5, 1.8) # meters, length x width
+    FOV        = math.pi / 2
+
+    def __init__(self, width=1280, height=720, frames_dir=None):
+        self.width   = width
+        self.height  = height
+        self.drone   = Drone()
+        self.car     = Car()
+        self.time    = 0.0
+        self.paused  = False
+        self.api_control = False
+        self._wall   = time.time()
+        self._lock   = threading.RLock()
+
+        # Textured ground, drawn once, frames copy it and paint the car on top
+        rng = np.random.RandomState(0)
+        self._ground = np.empty((height, width, 4), dtype=np.uint8)
+        self._ground[..., :3] = rng.randint(90, 130, (height // 8 + 1, width // 8 + 1, 1)) \
+                                   .repeat(8, axis=0).repeat(8, axis=1)[:height, :width]
+        self._ground[..., 3]  = 255
+
+        self._frames = []
+        if frames_dir is not None:
+            self._frames = sorted(os.path.join(frames_dir, f) for f in os.listdir(frames_dir) if f.endswith('.png'))
+        self._frame_index = 0
+
+    # Clock
+    def _sync(self):
+        """ Catch the simulation up with the wall clock unless paused
+        """
+        now = time.time()
+        elapsed, self._wall = now - self._wall, now
+        if not self.paused:
+            self._advance(elapsed)
+
+    def _advance(self, seconds):
+        with self._lock:
+            while seconds > 1e-9:
+                dt = min(self.PHYSICS_DT, seconds)
+                self.time += dt
+                self.drone.step(dt, self.time)
+                self.car.step(dt)
+                seconds -= dt
+
+    def ping(self):
+        return True
+
+    def reset(self):
+        with self._lock:
+            self.drone.reset()
+            self.car.reset()
+        return True
+
+    def simPause(self, is_paused):
+        self._sync()
+        self.paused = bool(is_paused)
+        return True
+
+    def simIsPaused(self):
+        return self.paused
+
+    def simContinueForTime(self, seconds):
+        self._sync()
+        self._advance(seconds)
+        self.paused = True
+        return True
+
+    def simGetTime(self):
+        self._sync()
+        return self.time
+
+    # Multirotor
+    def enableApiControl(self, is_enabled, *args):
+        self.api_control = bool(is_enabled)
+        return True
+
+    def isApiControlEnabled(self, *args):
+        return self.api_control
+
+    def armDisarm(self, arm, *args):
+        return True
+
+    def takeoff(self, *args):
+        self._sync()
+        self.drone.command = ('position', np.array([self.drone.position[0], self.drone.position[1], Drone.TAKEOFF_Z]),
+                              2.0, None)
+        return True
+
+    def hover(self, *args):
+        self._sync()
+        self.drone.command = ('hover', None, None, None)
+        return True
+
+    def moveByVelocity(self, vx, vy, vz, duration, *args):
+        self._sync()
+        self.drone.command = ('velocity', np.array([vx, vy, vz], dtype=float), None, self.time + duration)
+        return True
+
+    def moveByVelocityZ(self, vx, vy, z, duration, *args):
+        self._sync()
+        self.drone.command = ('velocityz', np.array([vx, vy, z], dtype=float), None, self.time + duration)
+        return True
+
+    def moveToPosition(self, x, y, z, velocity, *args):
+        self._sync()
+        self.drone.command = ('position', np.array([x, y, z], dtype=float), float(velocity), None)
+        return True
+
+    def moveByAngle(self, pitch, roll, z, yaw, duration, *args):
+        self._sync()
+        self.drone.attitude = np.array([pitch, roll, yaw], dtype=float)
+        self.drone.command  = ('velocityz', np.array([0.0, 0.0, z]), None, self.time + duration)
+        return True
+
+    def getPosition(self, *args):
+        self._sync()
+        return vector(*self.drone.position)
+
+    def getVelocity(self, *args):
+        self._sync()
+        return vector(*self.drone.velocity)
+
+    def getOrientation(self, *args):
+        self._sync()
+        return quaternion(*self.drone.attitude)
+
+    def getCollisionInfo(self, *args):
+        self._sync()
+        collided = bool(self.drone.position[2] > 0.0) # Below the ground
+        return {'has_collided': collided, 'normal': vector(z=-1.0 if collided else 0.0),
+                'impact_point': vector(*self.drone.position), 'position': vector(*self.drone.position),
+                'penetration_depth': float(max(0.0, self.drone.position[2])), 'time_stamp': int(self.time * 1e9),
+                'object_name': 'Ground' if collided else '', 'object_id': -1}
+
+    def _kinematics(self, position, velocity, orientation):
+        return {'position': vector(*position), 'linear_velocity': vector(*velocity), 'orientation': orientation,
+                'angular_velocity': vector(), 'linear_acceleration': vector(), 'angular_acceleration': vector()}
+
+    def getMultirotorState(self, *args):
+        self._sync()
+        kinematics = self._kinematics(self.drone.position, self.drone.velocity, quaternion(*self.drone.attitude))
+        return {'collision': self.getCollisionInfo(), 'kinematics_estimated': kinematics,
+                'kinematics_true': kinematics, 'timestamp': int(self.time * 1e9)}
+
+    def simGetImages(self, requests, *args):
+        self._sync()
+        return [self._image_response(request) for request in requests]
+
+    def _image_response(self, request):
+        frame = self._render()
+        return {'image_data_uint8': frame[::-1].tobytes(), # AirSim frames come upside down
+                'image_data_float': [], 'camera_position': vector(*self.drone.position),
+                'camera_orientation': quaternion(*self.drone.attitude), 'time_stamp': int(self.time * 1e9),
+                'message': '', 'pixels_as_float': False, 'compress': False,
+                'width': self.width, 'height': self.height,
+                'image_type': request.get('image_type', 0) if isinstance(request, dict) else 0}
+
+    def _render(self):
+        if self._frames:
+            from PIL import Image
+            path = self._frames[self._frame_index % len(self._frames)]
+            self._frame_index += 1
+            return np.asarray(Image.open(path).convert('RGBA').resize((self.width, self.height)), dtype=np.uint8)
+
+        # Downward camera: image up is north (+x), image right is east (+y)
+        frame    = self._ground.copy()
+        altitude = max(0.5, -self.drone.position[2])
+        focal    = (self.width / 2.0) / math.tan(self.FOV / 2)
+        scale    = focal / altitude
+        offset   = self.car.position - self.drone.position
+        row      = self.height / 2.0 - offset[0] * scale
+        col      = self.width / 2.0 + offset[1] * scale
+        half_h   = self.CAR_SIZE[0] * scale / 2.0
+        half_w   = self.CAR_SIZE[1] * scale / 2.0
+        top, bottom = int(max(0, row - half_h)), int(min(self.height, row + half_h))
+        left, right = int(max(0, col - half_w)), int(min(self.width, col + half_w))
+        if top < bottom and left < right:
+            frame[top:bottom, left:right, :3] = (200, 30, 30)
+        return frame
+
+    # Car
+    def getCarState(self, *args):
+        self._sync()
+        kinematics = self._kinematics(self.car.position, self.car.velocity, quaternion(yaw=self.car.heading))
+        return {'speed': float(self.car.speed), 'gear': 1, 'collision': self.getCollisionInfo(),
+                'kinematics_true': kinematics, 'timestamp': int(self.time * 1e9)}
+
+    def setCarControls(self, controls, *args):
+        self._sync()
+        self.car.controls = dict((str(key), float(value)) for key, value in controls.items()
+                                 if key in ('throttle', 'brake', 'steering'))
+        return True
+
+
+class LatencyDispatcher(object):
+    """
+    Forwards the RPC calls to the simulation after an injected delay of latency +- jitter seconds, results
+    are passed through plain().
+    The delay is a timeout on the server's IO loop (`loop`, a msgpackrpc.Loop), not a sleep in the handler,
+    so the calls of several connections still overlap as they do against AirSim.
+    """
+    def __init__(self, sim, latency=0.0, jitter=0.0, loop=None):
+        self._sim     = sim
+        self._latency = latency
+        self._jitter  = jitter
+        self._loop    = loop
+
+    def __getattr__(self, name):
+        method = getattr(self._sim, name)
+        def call(*args):
+            delay = self._latency + random.uniform(-self._jitter, self._jitter)
+            if delay <= 0 or self._loop is None:
+                return plain(method(*args))
+
+            from msgpackrpc.server import AsyncResult
+            result = AsyncResult()
+            def respond():
+                try:
+                    result.set_result(plain(method(*args)))
+                except Exception as e:
+                    result.set_error(str(e))
+            self._loop._ioloop.add_timeout(time.time() + delay, respond)
+            return result
+        return call
+
+def serve(sim, host='127.0.0.1', port=41451, latency=0.0, jitter=0.0):
+    ''' Serve the simulation over msgpack-rpc on the AirSim port, blocks
+    '''
+    import msgpackrpc
+    loop   = msgpackrpc.Loop()
+    server = msgpackrpc.Server(LatencyDispatcher(sim, latency, jitter, loop), loop=loop)
+    server.listen(msgpackrpc.Address(host, port))
+    print "AirSim stand-in listening on", host, port
+    server.start()
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Local AirSim stand-in for headless runs and benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=41451)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--frames', help='Directory of recorded .png frames served instead of synthetic ones')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Uniform +- seconds around the latency')
+    args = parser.parse_args()
+
+    serve(StandInSim(args.width, args.height, args.frames), args.host, args.port, args.latency, args.jitter)
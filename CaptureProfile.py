@@ -0,0 +1,64 @@
+import numpy as np
+
+def rgba_to_rgb(data, height, width, size=None, out=None, region=None):
+    ''' Uncompressed AirSim scene image (RGBA, upside down) to an upright H x W x 3 RGB array.
+    The received bytes are viewed in place, flip and alpha removal are done through strides, so the pixels
+    are written exactly once, into `out` when given (preallocated buffer) or a new array.
+    region=(x, y, width, height) crops the upright image (pixels, top left origin), also as a view.
+    size=(width, height) resizes (nearest neighbour) in the same pass, integer factors stay a strided view.
+    '''
+    rgba = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 4)
+    view = rgba[::-1, :, :3]
+    if region is not None:
+        x, y, width, height = region
+        view = view[y:y + height, x:x + width]
+
+    if size is not None and tuple(size) != (width, height):
+        out_width, out_height = size
+        if height % out_height == 0 and width % out_width == 0:
+            view = view[::height // out_height, ::width // out_width]
+        else:
+            rows = (np.arange(out_height) * height) // out_height
+            cols = (np.arange(out_width) * width) // out_width
+            view = view[rows[:, np.newaxis], cols]
+
+    if out is None:
+        out = np.empty(view.shape, dtype=np.uint8)
+    np.copyto(out, view)
+    return out
+
+class CaptureProfile(object):
+    """
+    One image stream of a camera: region=(x, y, width, height) as fractions of the camera image (top left origin)
+    crops it, size=(width, height) resizes the crop, None keeps it. The RPC payload is whatever the camera renders,
+    so point the detection stream at a camera whose CaptureSettings in settings.json have the detector's input
+    resolution (the SSD graph resizes to 300x300 anyway), cropping / resizing here only shrinks the detector input.
+    """
+    def __init__(self, camera_id=3, size=None, region=None):
+        self.camera_id = camera_id
+        self.size      = size
+        self.region    = region
+
+    def request(self):
+        from AirSimClient import ImageRequest, AirSimImageType # Only the connector sends requests
+        return ImageRequest(self.camera_id, AirSimImageType.Scene, False, False)
+
+    def convert(self, response, out=None):
+        region = None
+        if self.region is not None:
+            x, y, width, height = self.region
+            region = (int(round(x * response.width)), int(round(y * response.height)),
+                      int(round(width * response.width)), int(round(height * response.height)))
+        return rgba_to_rgb(response.image_data_uint8, response.height, response.width, self.size, out, region)
+
+    def to_frame(self, output, image_shape, frame_shape):
+        """ Detector output (POS_X, POS_Y, WIDTH, HEIGHT) on an image of this stream to the same box on the full
+        camera view of frame_shape (height, width), both in pixels from the image center, y up
+        """
+        x, y, width, height = self.region or (0.0, 0.0, 1.0, 1.0)
+        im_height, im_width       = image_shape[:2]
+        frame_height, frame_width = frame_shape[:2]
+        return ((x + (float(output[0]) / im_width + 0.5) * width) * frame_width - frame_width / 2.0,
+                frame_height / 2.0 - (y + (0.5 - float(output[1]) / im_height) * height) * frame_height,
+                float(output[2]) / im_width * width * frame_width,
+                float(output[3]) / im_height * height * frame_height)
@@ -7,8 +7,10 @@ python_path = os.path.abspath('AirSim/PythonClient')
 sys.path.append(python_path)
 from AirSimClient import *
 
+from ConnectionPool import VehicleClient
+
 class CarConnector:
-    def __init__(self):
+    def __init__(self, vehicle_name='', pool=None):
         self.MAX_SPEED    = 30.0
         self.MIN_SPEED    = 0.0
 
@@ -19,8 +21,16 @@ class CarConnector:
         self.max_actions = 120
         self.mode        = "still"
 
-        self.client = CarClient()
-        self.client.confirmConnection()
+        # vehicle_name - car of a multi-vehicle simulator, '' is the default vehicle
+        # pool         - ConnectionPool of CarClient connections to lease from instead of opening a new one
+        self.vehicle_name = vehicle_name
+        self.pool         = pool
+        if pool is not None:
+            client = pool.acquire()
+        else:
+            client = CarClient()
+            client.confirmConnection()
+        self.client = VehicleClient(client, vehicle_name)
         self.client.enableApiControl(True)
 
         self.car_controls          = CarControls()
@@ -28,39 +38,67 @@ class CarConnector:
         self.car_controls.throttle = 0
         self.car_controls.steering = 0
 
+        self.current_state = None # getCarState() of the current tick, see snapshot()
+
+    def snapshot(self):
+        """ One getCarState call per tick, served by the get_* methods and the driver until the next drive() / reset()
+        """
+        self.current_state = self.client.getCarState()
+        return self.current_state
+
+    def get_state(self):
+        if self.current_state is None:
+            return self.client.getCarState()
+        return self.current_state
+
     def disconnect(self):
         self.client.enableApiControl(False)
 
+    def close(self):
+        """ Hand the connection back to the pool
+        """
+        if self.pool is not None:
+            self.pool.release(self.client._client)
+        self.client = None
+
     def get_position(self):
-        state = self.client.getCarState()
+        state = self.get_state()
         pos   = state.kinematics_true.position
         return pos
 
     def get_orientation(self):
-        state = self.client.getCarState()
+        state = self.get_state()
         ort   = state.kinematics_true.orientation
         return self.client.getPitchRollYaw(ort)
 
     def get_position_and_orientation(self):
-        state = self.client.getCarState()
+        state = self.get_state()
         pos   = state.kinematics_true.position
         ort   = state.kinematics_true.orientation
         return pos, self.client.toEulerianAngle(ort)
 
-    def reset(self):
+    def reset(self, world=True):
+        """ world=False leaves the simulator as it is (other vehicles of a multi-vehicle world), the car only stops
+        where it is
+        """
         self.index                 = 0
         self.car_controls.brake    = 0
         self.car_controls.throttle = 0
         self.car_controls.steering = 0
 
-        self.client.reset()
+        if world:
+            self.client.reset()
+        else:
+            self.client.setCarControls(self.car_controls)
         self.client.enableApiControl(True)
+        self.current_state = None
         pos, ort = self.get_position_and_orientation()
         return pos, ort
 
     def drive(self):
         self.get_controls()
         self.client.setCarControls(self.car_controls)
+        self.current_state = None
 
     def get_controls(self):
         if self.mode=="still":
@@ -89,7 +127,7 @@ class CarConnector:
             if self.index % 4 == 0:
                 x = np.random.randint(1, high=4)
                 if x==1:
-                    if self.client.getCarState().speed >= self.MAX_SPEED-5.0:
+                    if self.get_state().speed >= self.MAX_SPEED-5.0:
                         print "[DRIVER]: BRAKE"
                         self.car_controls.brake    = 1
                         self.car_controls.throttle = 0
@@ -102,7 +140,7 @@ class CarConnector:
                     self.car_controls.brake    = 0
                     self.car_controls.throttle = 0
                 else:
-                    if self.client.getCarState().speed >= self.MAX_SPEED/2.0:
+                    if self.get_state().speed >= self.MAX_SPEED/2.0:
                         print "[DRIVER]: BRAKE"
                         self.car_controls.brake    = 1
                         self.car_controls.throttle = 0
@@ -0,0 +1,93 @@
+import os
+import re
+import json
+import shutil
+import threading
+import numpy as np
+
+class CheckpointManager(object):
+    """
+    Full training-state checkpoints written in the background.
+    A snapshot (all graph variables including the target network and optimizer slots, the replay memory
+    and the agent counters) is captured by the caller on the training thread, then written by a writer
+    thread into `state-<step>.tmp/` and renamed to `state-<step>/` once complete, so a crash never leaves
+    a half written checkpoint behind. Only the last `keep` checkpoints are kept.
+    """
+    PREFIX = 'state-'
+
+    def __init__(self, directory, keep=3):
+        self.directory = directory
+        self.keep      = keep
+        self._thread   = None # The directory is created by the first save, listing it never does
+
+    def checkpoints(self):
+        """ Paths of the complete checkpoints, oldest first
+        """
+        steps = []
+        if not os.path.isdir(self.directory):
+            return steps
+        for name in os.listdir(self.directory):
+            match = re.match(re.escape(self.PREFIX) + r'(\d+)$', name)
+            if match and os.path.isdir(os.path.join(self.directory, name)):
+                steps.append(int(match.group(1)))
+        return [os.path.join(self.directory, self.PREFIX + str(step)) for step in sorted(steps)]
+
+    def latest(self):
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def save(self, step, variables, memory, agent_state):
+        """ Write a snapshot in the background. The arrays must not be modified by the caller afterwards.
+            variables   - {variable name: value}
+            memory      - {array name: value} as returned by ReplayMemory.snapshot()
+            agent_state - JSON serialisable dict of counters
+        """
+        # One write in flight at a time, a save interval shorter than a write blocks here
+        self.wait()
+        self._thread = threading.Thread(target=self._write, args=(step, variables, memory, agent_state))
+        self._thread.start()
+
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _write(self, step, variables, memory, agent_state):
+        path = os.path.join(self.directory, self.PREFIX + str(step))
+        tmp  = path + '.tmp'
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+
+        names = sorted(variables.keys())
+        np.savez(os.path.join(tmp, 'variables.npz'), names=np.array(names),
+                 **dict(('v%d' % i, variables[name]) for i, name in enumerate(names)))
+        np.savez(os.path.join(tmp, 'memory.npz'), **memory)
+        with open(os.path.join(tmp, 'agent.json'), 'w') as f:
+            json.dump(agent_state, f, indent=2, sort_keys=True)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp, path)
+        print "Successfully saved:", path
+
+        for old in self.checkpoints()[:-self.keep]:
+            shutil.rmtree(old)
+
+    def load_variables(self, path):
+        with np.load(os.path.join(path, 'variables.npz')) as data:
+            names = [str(name) for name in data['names']]
+            return dict((name, data['v%d' % i]) for i, name in enumerate(names))
+
+    def load(self, path=None):
+        """ (variables, memory, agent_state) of the given or latest checkpoint, None if there is none
+        """
+        path = path or self.latest()
+        if path is None:
+            return None
+
+        with np.load(os.path.join(path, 'memory.npz')) as data:
+            memory = dict((key, data[key]) for key in data.files)
+        with open(os.path.join(path, 'agent.json')) as f:
+            agent_state = json.load(f)
+        return self.load_variables(path), memory, agent_state
@@ -0,0 +1,52 @@
+import threading
+
+from ExportPolicy import latest_checkpoint, load_weights
+
+class CheckpointWatcher(object):
+    """
+    Picks up new checkpoints of a running training while a test deployment keeps going.
+    A background thread polls the checkpoint directory every `interval` seconds and reads the weights of
+    any newer checkpoint, the decision loop only calls poll() between two decisions and swaps the returned
+    weights in (NumpyPolicy.set_weights, PolicyServer.set_weights), which is a pointer swap.
+    `source` is the checkpoint currently deployed, None reloads the latest checkpoint on the first poll.
+    """
+    def __init__(self, checkpoint_dir, interval=5.0, source=None):
+        self.checkpoint_dir = checkpoint_dir
+        self.interval       = interval
+        self.source         = source
+
+        self._pending = None
+        self._lock    = threading.Lock()
+        self._stop    = threading.Event()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                source = latest_checkpoint(self.checkpoint_dir)
+                if source is not None and source != self.source:
+                    weights = load_weights(source)
+                    with self._lock:
+                        self._pending = (source, weights)
+                    self.source = source
+            except Exception as e:
+                # A checkpoint pruned or rewritten while reading, try again on the next poll
+                print "Checkpoint reload failed:", e
+            self._stop.wait(self.interval)
+
+    def poll(self):
+        """ Weights of a checkpoint newer than the last poll, None if there is none
+        """
+        if self._pending is None:
+            return None
+        with self._lock:
+            (source, weights), self._pending = self._pending, None
+        print "Reloaded:", source
+        return weights
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,73 @@
+import inspect
+import threading
+import functools
+import contextlib
+
+class ConnectionPool(object):
+    """
+    Up to `size` simulator connections made by `factory` (e.g. MultirotorClient), shared by the connectors of one
+    process. acquire() hands out an idle connection, opens a new one while under `size`, and blocks otherwise until
+    one is released. A connection serves one thread at a time, msgpack-rpc clients are not thread safe.
+    """
+    def __init__(self, factory, size):
+        self.factory  = factory
+        self.size     = size
+        self._idle    = []
+        self._created = 0
+        self._lock    = threading.Condition()
+
+    def acquire(self):
+        with self._lock:
+            while not self._idle and self._created >= self.size:
+                self._lock.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        try:
+            client = self.factory()
+            client.confirmConnection()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+                self._lock.notify()
+            raise
+        return client
+
+    def release(self, client):
+        with self._lock:
+            self._idle.append(client)
+            self._lock.notify()
+
+    @contextlib.contextmanager
+    def lease(self):
+        client = self.acquire()
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+class VehicleClient(object):
+    """
+    Client bound to one named vehicle of a multi-vehicle simulator: every method taking a `vehicle_name` gets this
+    vehicle's. The default vehicle ('') works with any client, other names need a client with multi-vehicle calls.
+    """
+    def __init__(self, client, vehicle_name=''):
+        self._client      = client
+        self.vehicle_name = vehicle_name
+        self._named       = {}
+        if vehicle_name and not self._takes_name('enableApiControl'):
+            raise Exception('AirSim client without multi-vehicle support, cannot address vehicle ' + vehicle_name)
+
+    def _takes_name(self, name):
+        if name not in self._named:
+            try:
+                self._named[name] = 'vehicle_name' in inspect.getargspec(getattr(self._client, name)).args
+            except TypeError:
+                self._named[name] = False # Builtins and non-functions
+        return self._named[name]
+
+    def __getattr__(self, name):
+        value = getattr(self._client, name)
+        if self.vehicle_name and callable(value) and self._takes_name(name):
+            return functools.partial(value, vehicle_name=self.vehicle_name)
+        return value
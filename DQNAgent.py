@@ -1,15 +1,57 @@
 # from Environment import Environment
-# from EnvironmentSeq import EnvironmentSeq
-from EnvironmentSeq import EnvironmentSeq
-from EnvironmentSeqRT import EnvironmentSeqRT
+# Environments, TensorFlow and keras are imported on first use, see StartupBenchmark.py
+from LazyModule import LazyModule
+from ExperienceCollector import ExperienceCollector
+from NumpyPolicy import NumpyPolicy, History
+from Telemetry import Telemetry
+from CheckpointManager import CheckpointManager
 
 import os
+import sys
+import time
 import random
+import threading
 import numpy as np
-import tensorflow as tf
+import Queue
 from collections import deque
-from keras.models import Sequential
-from keras.layers import Convolution2D, Flatten, Dense, LSTM
+
+tf = LazyModule('tensorflow')
+
+class PackedBits(object):
+    """
+    Boolean array stored one bit per entry, indexable like a 1-D NumPy array (int, slice or index array).
+    Reads return uint8 0/1 arrays.
+    """
+    def __init__(self, size):
+        self._size = size
+        self._bits = np.zeros((size + 7) // 8, dtype=np.uint8)
+
+    def __len__(self):
+        return self._size
+
+    def _indexes(self, key):
+        if isinstance(key, slice):
+            return np.arange(*key.indices(self._size))
+        return np.asarray(key)
+
+    def __getitem__(self, key):
+        indexes = self._indexes(key)
+        return (self._bits[indexes >> 3] >> (7 - (indexes & 7))) & 1
+
+    def __setitem__(self, key, value):
+        if isinstance(key, (int, np.integer)):
+            if value:
+                self._bits[key >> 3] |= np.uint8(1 << (7 - (key & 7)))
+            else:
+                self._bits[key >> 3] &= np.uint8(~(1 << (7 - (key & 7))) & 0xFF)
+            return
+
+        indexes = self._indexes(key)
+        value   = np.broadcast_to(np.asarray(value).astype(bool), indexes.shape)
+        masks   = (1 << (7 - (indexes & 7))).astype(np.uint8)
+        np.bitwise_or.at(self._bits, indexes[value] >> 3, masks[value])
+        np.bitwise_and.at(self._bits, indexes[~value] >> 3, ~masks[~value])
+
 
 class ReplayMemory(object):
     """
@@ -17,36 +59,147 @@ class ReplayMemory(object):
     We store all the transitions (s(t), action, s(t+1), reward, done).
     The replay memory allows us to efficiently sample minibatches from it, and generate the correct state representation
     (w.r.t the number of previous frames needed).
+
+    Storage is pluggable: states can be kept as float16, or as uint8 frames where the float value is
+    stored_value * state_scale (e.g. 1/255), and terminals can be bit-packed. Everything is converted back to
+    float32 only when a minibatch is assembled.
+
+    Steps appended with truncated set end a piece of an episode that continues elsewhere (e.g. a worker buffer
+    cut by ExperienceCollector.drain): they are not terminal, but no transition or history window is built
+    across them.
+
+    Writes and minibatch assembly hold a lock, so a MinibatchPrefetcher can sample while the training thread appends.
+
+    With nb_actions set, every step also stores the counterfactual outcome of all actions (reward and next
+    state per action, as given by environments that can evaluate every action at once). Minibatches then
+    draw a random action per sampled step, so each stored step stands for nb_actions transitions.
     """
-    def __init__(self, size, sample_shape, history_length=4):
+    def __init__(self, size, sample_shape, history_length=4, state_dtype=np.float32, state_scale=1.0,
+                 pack_terminals=False, nb_actions=None):
         self._pos            = 0
         self._count          = 0
         self._max_size       = size
         self._history_length = max(1, history_length)
         self._state_shape    = sample_shape
-        self._states         = np.zeros((size,) + sample_shape, dtype=np.float32)
+        self._state_scale    = state_scale
+        self._states         = np.zeros((size,) + sample_shape, dtype=state_dtype)
         self._actions        = np.zeros(size, dtype=np.uint8)
         self._rewards        = np.zeros(size, dtype=np.float32)
-        self._terminals      = np.zeros(size, dtype=np.float32)
+        self._terminals      = PackedBits(size) if pack_terminals else np.zeros(size, dtype=np.float32)
+        self._truncated      = PackedBits(size) if pack_terminals else np.zeros(size, dtype=np.uint8)
+        self._nb_actions     = nb_actions
+        self._lock           = threading.RLock()
+        if nb_actions is not None:
+            self._action_rewards     = np.zeros((size, nb_actions), dtype=np.float32)
+            self._action_next_states = np.zeros((size, nb_actions) + sample_shape, dtype=state_dtype)
+
+    def _encode(self, states):
+        """ Convert states to the storage dtype
+        """
+        states = np.asarray(states)
+        if states.dtype == self._states.dtype:
+            return states
+        if np.issubdtype(self._states.dtype, np.integer):
+            info = np.iinfo(self._states.dtype)
+            return np.clip(np.round(states / self._state_scale), info.min, info.max)
+        return states / self._state_scale if self._state_scale != 1.0 else states
+
+    def _decode(self, states):
+        """ Convert stored states to float32
+        """
+        states = states.astype(np.float32)
+        if self._state_scale != 1.0:
+            states *= self._state_scale
+        return states
 
     def __len__(self):
         """ Returns the number of items currently present in the memory
         """
         return self._count
 
-    def append(self, state, action, reward, done):
+    def append(self, state, action, reward, done, action_rewards=None, action_next_states=None, truncated=False):
         """ Appends the specified transition to the memory.
+            action_rewards / action_next_states - reward and next state of every action, required with nb_actions
+            truncated - the next transition does not follow this one
         """
         assert state.shape == self._state_shape, \
             'Invalid state shape (required: %s, got: %s)' % (self._state_shape, state.shape)
 
-        self._states[self._pos]    = state
-        self._actions[self._pos]   = action
-        self._rewards[self._pos]   = reward
-        self._terminals[self._pos] = done
-
-        self._count = max(self._count, self._pos + 1)
-        self._pos   = (self._pos + 1) % self._max_size
+        with self._lock:
+            self._states[self._pos]    = self._encode(state)
+            self._actions[self._pos]   = action
+            self._rewards[self._pos]   = reward
+            self._terminals[self._pos] = done
+            self._truncated[self._pos] = truncated
+            if self._nb_actions is not None:
+                self._action_rewards[self._pos]     = action_rewards
+                self._action_next_states[self._pos] = self._encode(action_next_states)
+
+            self._count = max(self._count, self._pos + 1)
+            self._pos   = (self._pos + 1) % self._max_size
+
+    def extend(self, states, actions, rewards, dones, action_rewards=None, action_next_states=None, truncated=None):
+        """ Appends a block of consecutive transitions to the memory in one go, truncated as in #append()
+        """
+        n = len(actions)
+        if n == 0:
+            return
+        assert states.shape[1:] == self._state_shape, \
+            'Invalid state shape (required: %s, got: %s)' % (self._state_shape, states.shape[1:])
+        if n > self._max_size:
+            states, actions, rewards, dones = states[-self._max_size:], actions[-self._max_size:], \
+                                              rewards[-self._max_size:], dones[-self._max_size:]
+            if truncated is not None:
+                truncated = truncated[-self._max_size:]
+            if self._nb_actions is not None:
+                action_rewards, action_next_states = action_rewards[-self._max_size:], \
+                                                     action_next_states[-self._max_size:]
+            n = self._max_size
+
+        with self._lock:
+            indexes = np.arange(self._pos, self._pos + n) % self._max_size
+            self._states[indexes]    = self._encode(states)
+            self._actions[indexes]   = actions
+            self._rewards[indexes]   = rewards
+            self._terminals[indexes] = dones
+            self._truncated[indexes] = truncated if truncated is not None else 0
+            if self._nb_actions is not None:
+                self._action_rewards[indexes]     = action_rewards
+                self._action_next_states[indexes] = self._encode(action_next_states)
+
+            self._count = min(self._max_size, max(self._count, self._pos + n))
+            self._pos   = (self._pos + n) % self._max_size
+
+    def snapshot(self):
+        """ Copy of the memory content, to be restored with #restore()
+        """
+        with self._lock:
+            snapshot = {
+                'states'    : self._states[:self._count].copy(),
+                'actions'   : self._actions[:self._count].copy(),
+                'rewards'   : self._rewards[:self._count].copy(),
+                'terminals' : self._terminals[:self._count].copy(),
+                'truncated' : self._truncated[:self._count].copy(),
+                'pos'       : np.array(self._pos),
+            }
+            if self._nb_actions is not None:
+                snapshot['action_rewards']     = self._action_rewards[:self._count].copy()
+                snapshot['action_next_states'] = self._action_next_states[:self._count].copy()
+            return snapshot
+
+    def restore(self, snapshot):
+        with self._lock:
+            count = min(len(snapshot['actions']), self._max_size)
+            self._states[:count]    = snapshot['states'][:count]
+            self._actions[:count]   = snapshot['actions'][:count]
+            self._rewards[:count]   = snapshot['rewards'][:count]
+            self._terminals[:count] = snapshot['terminals'][:count]
+            self._truncated[:count] = snapshot['truncated'][:count] if 'truncated' in snapshot else 0
+            if self._nb_actions is not None and 'action_rewards' in snapshot:
+                self._action_rewards[:count]     = snapshot['action_rewards'][:count]
+                self._action_next_states[:count] = snapshot['action_next_states'][:count]
+            self._count = count
+            self._pos   = int(snapshot['pos']) % self._max_size
 
     def sample(self, size):
         """ Generate size random integers mapping indices in the memory.
@@ -54,8 +207,8 @@ class ReplayMemory(object):
             See the method #minibatch() if you want to retrieve samples directly.
         """
         # Local variable access is faster in loops
-        count, pos, history_len, terminals = self._count - 1, self._pos, \
-                                             self._history_length, self._terminals
+        count, pos, history_len, terminals, truncated = self._count - 1, self._pos, \
+                                                        self._history_length, self._terminals, self._truncated
         indexes = []
 
         while len(indexes) < size:
@@ -66,7 +219,9 @@ class ReplayMemory(object):
                 # if not wrapping over current pointer,
                 # then check if there is terminal state wrapped inside
                 if not (index >= pos > index - history_len):
-                    if not terminals[(index - history_len):index].any():
+                    # nor a cut in the pre or post state window
+                    if not terminals[(index - history_len):index].any() and \
+                       not truncated[(index - history_len):index + 1].any():
                         indexes.append(index)
 
         return indexes
@@ -74,15 +229,24 @@ class ReplayMemory(object):
     def minibatch(self, size):
         """ Generate a minibatch with the number of samples specified by the size parameter.
         """
-        indexes = self.sample(size)
+        with self._lock:
+            indexes = np.array(self.sample(size))
+
+            # sample() only returns indexes with a full history window behind them, gather all windows at once
+            windows     = indexes[:, np.newaxis] + np.arange(1 - self._history_length, 1)
+            pre_states  = self._decode(self._states[windows])
+            post_states = self._decode(self._states[windows + 1])
+            actions     = self._actions[indexes]
+            rewards     = self._rewards[indexes]
+            dones       = np.asarray(self._terminals[indexes], dtype=np.float32)
 
-        pre_states  = np.array([self.get_state(index) for index in indexes], dtype=np.float32)
-        post_states = np.array([self.get_state(index + 1) for index in indexes], dtype=np.float32)
-        actions     = self._actions[indexes]
-        rewards     = self._rewards[indexes]
-        dones       = self._terminals[indexes]
+            if self._nb_actions is not None:
+                # Counterfactual transitions - any action of the sampled step, the next state only differs in its last frame
+                actions            = np.random.randint(0, self._nb_actions, size=len(indexes)).astype(np.uint8)
+                rewards            = self._action_rewards[indexes, actions]
+                post_states[:, -1] = self._decode(self._action_next_states[indexes, actions])
 
-        return pre_states, actions, post_states, rewards, dones
+            return pre_states, actions, post_states, rewards, dones
 
     def get_state(self, index):
         """
@@ -97,36 +261,57 @@ class ReplayMemory(object):
 
         # If index > history_length, take from a slice
         if index >= history_length:
-            return self._states[(index - (history_length - 1)):index + 1, ...]
+            return self._decode(self._states[(index - (history_length - 1)):index + 1, ...])
         else:
             indexes = np.arange(index - history_length + 1, index + 1)
-            return self._states.take(indexes, mode='wrap', axis=0)
+            return self._decode(self._states.take(indexes, mode='wrap', axis=0))
 
 
-class History(object):
+class MinibatchPrefetcher(object):
     """
-    Accumulator keeping track of the N previous frames to be used by the agent
-    for evaluation
+    Samples and assembles minibatches from a ReplayMemory on a background thread, so the next minibatch
+    is ready while the current update runs and replay sampling is off the critical path of training.
+    Minibatches may be one update stale with respect to the latest appended transitions.
     """
-    def __init__(self, shape):
-        self._buffer = np.zeros(shape, dtype=np.float32)
-
-    @property
-    def value(self):
-        """ Underlying buffer with N previous states stacked along first axis
+    def __init__(self, memory, batch_size, depth=2):
+        self._memory     = memory
+        self._batch_size = batch_size
+        self._queue      = Queue.Queue(maxsize=depth)
+        self._stop       = threading.Event()
+        self._error      = None
+        self._thread     = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                continue
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                self._put(self._memory.minibatch(self._batch_size))
+        except Exception:
+            # Handed to the training thread, get() raises it instead of waiting for batches that never come
+            self._error = sys.exc_info()
+            self._put(None)
+
+    def get(self):
+        """ Next minibatch (pre_states, actions, post_states, rewards, dones), raises what sampling raised
         """
-        return self._buffer
+        batch = self._queue.get()
+        if batch is None:
+            self._queue.put(None) # Raise again on the next call
+            raise self._error[0], self._error[1], self._error[2]
+        return batch
 
-    def append(self, state):
-        """ Append state to the history
-        """
-        self._buffer[:-1] = self._buffer[1:]
-        self._buffer[-1]  = state
-
-    def reset(self):
-        """ Reset the memory. Underlying buffer set all indexes to 0
-        """
-        self._buffer.fill(0)
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
 
 
 class DeepQAgent(object):
@@ -146,13 +331,21 @@ class DeepQAgent(object):
     TARGET_UPDATE_INTERVAL = 20000  # The frequency with which the target network is updated
     TRAIN_AFTER            = 4000 # Number of Steps after which training starts
     TRAIN_INTERVAL         = 4  # The agent selects 4 actions between successive updates
+    PREFETCH               = True  # Sample minibatches on a background thread while the network trains
     LEARNING_RATE          = 0.00025  # Learning rate used by RMSProp
     MOMENTUM               = 0.95  # Momentum used by RMSProp
     MIN_GRAD               = 0.01  # Constant added to the squared gradient in the denominator of the RMSProp update
     SAVE_INTERVAL          = 20000  # The frequency with which the network is saved
+    KEEP_CHECKPOINTS       = 3  # Number of full training-state checkpoints kept on disk
     LOAD_NETWORK           = False
+    REPLAY_STATE_DTYPE     = np.float32  # Replay storage of states, np.float16 halves it, np.uint8 (with a scale) for frames
+    REPLAY_STATE_SCALE     = 1.0  # Float value of a stored state is stored * scale
+    REPLAY_PACK_TERMINALS  = True  # Store terminal flags as bits
+    COUNTERFACTUAL_ACTIONS = False  # Store the reward and next state of every action (environments with all_actions)
     SAVE_NETWORK_PATH      = 'models'
     SAVE_SUMMARY_PATH      = 'logs'
+    INTRA_OP_THREADS       = 0  # Threads used inside a single TF op, 0 lets TF pick (all cores)
+    INTER_OP_THREADS       = 0  # Threads used to run independent TF ops, 0 lets TF pick
 
     def __init__(self, input_shape, nb_actions):
         self.t            = 0
@@ -169,12 +362,18 @@ class DeepQAgent(object):
         self.nb_actions   = nb_actions
 
         self._history           = History(input_shape)
-        self._memory            = ReplayMemory(self.MEMORY_SIZE, input_shape[1:], self.STATE_LENGTH)
+        self._memory            = ReplayMemory(self.MEMORY_SIZE, input_shape[1:], self.STATE_LENGTH,
+                                               state_dtype=self.REPLAY_STATE_DTYPE, state_scale=self.REPLAY_STATE_SCALE,
+                                               pack_terminals=self.REPLAY_PACK_TERMINALS,
+                                               nb_actions=nb_actions if self.COUNTERFACTUAL_ACTIONS else None)
         self._num_actions_taken = 0
+        self._history_q_values  = None
+        self._prefetcher        = None
 
         # Action Value model (used by agent to interact with the environment)
         self.s, self.q_values, q_network = self.build_network(self.input_shape)
         q_network_weights = q_network.trainable_weights
+        self.q_network_weights = q_network_weights
 
         # Target model used to compute the target Q-values in training, updated
         # less frequently for increased stability.
@@ -185,27 +384,34 @@ class DeepQAgent(object):
         self.update_target_network = [target_network_weights[i].assign(q_network_weights[i]) for i in range(len(target_network_weights))]
 
         # Define loss and gradient update operation
-        self.a, self.y, self.loss, self.grads_update = self.build_training_op(q_network_weights)
+        self.a, self.r, self.d, self.loss, self.grads_update = self.build_training_op(q_network_weights)
 
-        self.sess  = tf.InteractiveSession()
+        self.sess  = tf.InteractiveSession(config=tf.ConfigProto(intra_op_parallelism_threads=self.INTRA_OP_THREADS,
+                                                                 inter_op_parallelism_threads=self.INTER_OP_THREADS))
         self.saver = tf.train.Saver(q_network_weights)
 
-        self.summary_placeholders, self.update_ops, self.summary_op = self.setup_summary()
         self.summary_writer = tf.summary.FileWriter(self.SAVE_SUMMARY_PATH, self.sess.graph)
+        self.telemetry      = Telemetry(self.SAVE_SUMMARY_PATH, writer=self.summary_writer)
 
         if not os.path.exists(self.SAVE_NETWORK_PATH):
             os.makedirs(self.SAVE_NETWORK_PATH)
+        self.checkpoints = CheckpointManager(self.SAVE_NETWORK_PATH, keep=self.KEEP_CHECKPOINTS)
 
         self.sess.run(tf.initialize_all_variables())
 
-        # Load network
+        # Load network, a full training state already contains the target network
+        restored = False
         if self.LOAD_NETWORK:
-            self.load_network()
+            restored = self.load_network()
 
         # Initialize target network
-        self.sess.run(self.update_target_network)
+        if not restored:
+            self.sess.run(self.update_target_network)
 
     def build_network(self, input_shape):
+        from keras.models import Sequential
+        from keras.layers import Dense, LSTM
+
         model = Sequential()
         model.add(LSTM(16, input_shape=input_shape)) # 32
         model.add(Dense(32, activation='relu')) # 64
@@ -219,7 +425,11 @@ class DeepQAgent(object):
 
     def build_training_op(self, q_network_weights):
         a = tf.placeholder(tf.int64, [None])
-        y = tf.placeholder(tf.float32, [None])
+        r = tf.placeholder(tf.float32, [None])
+        d = tf.placeholder(tf.float32, [None])
+
+        # Target computed in graph so the target network forward pass and the update share one sess.run
+        y = tf.stop_gradient(r + (1.0 - d) * self.GAMMA * tf.reduce_max(self.target_q_values, axis=1))
 
         # Convert action to one hot vector
         a_one_hot = tf.one_hot(a, self.nb_actions, 1.0, 0.0)
@@ -234,7 +444,17 @@ class DeepQAgent(object):
         optimizer    = tf.train.RMSPropOptimizer(self.LEARNING_RATE, momentum=self.MOMENTUM, epsilon=self.MIN_GRAD)
         grads_update = optimizer.minimize(loss, var_list=q_network_weights)
 
-        return a, y, loss, grads_update
+        return a, r, d, loss, grads_update
+
+    def evaluate(self):
+        """ Q-values of the current history. The forward pass runs at most once per environment step,
+        the result is cached until the history changes and shared by action selection and statistics.
+        """
+        if self._history_q_values is None:
+            env_with_history = self._history.value
+            with self.telemetry.timer('q_eval'):
+                self._history_q_values = self.q_values.eval(feed_dict={self.s: env_with_history[np.newaxis]})[0]
+        return self._history_q_values
 
     def act(self, state):
         """ This allows the agent to select the next action to perform in regard of the current state of the environment.
@@ -242,14 +462,20 @@ class DeepQAgent(object):
         """
         # Append the state to the short term memory (ie. History)
         self._history.append(state)
+        self._history_q_values = None
 
-        if self.epsilon >= random.random() or self.t < self.INITIAL_REPLAY_SIZE:
-            # Choose an action randomly
+        if self.t < self.INITIAL_REPLAY_SIZE:
+            # Choose an action randomly, Q-values are neither needed for acting nor for the summaries
             action = random.randrange(self.nb_actions)
         else:
-            # Use the network to output the best action
-            env_with_history = self._history.value
-            action = np.argmax(self.q_values.eval(feed_dict={self.s: env_with_history.reshape((1,) + env_with_history.shape)}))
+            # Q-values are needed for the episode statistics in any case, so compute them once here
+            q_values = self.evaluate()
+            if self.epsilon >= random.random():
+                # Choose an action randomly
+                action = random.randrange(self.nb_actions)
+            else:
+                # Use the network to output the best action
+                action = np.argmax(q_values)
 
         # Anneal epsilon linearly over time
         if self.epsilon > self.FINAL_EPSILON and self.t >= self.INITIAL_REPLAY_SIZE:
@@ -257,30 +483,30 @@ class DeepQAgent(object):
 
         # Keep track of interval action counter
         self._num_actions_taken += 1
+        self.telemetry.count('env_steps')
+        self.telemetry.gauge('epsilon', self.epsilon)
         return action
 
-    def observe(self, old_state, action, reward, done):
+    def observe(self, old_state, action, reward, done, action_rewards=None, action_next_states=None):
         """ This allows the agent to observe the output of doing the action it selected through act() on the old_state
+        action_rewards / action_next_states are the outcome of every action, used with COUNTERFACTUAL_ACTIONS
         """
         self.total_reward += reward
 
         # If done, reset short term memory (ie. History)
         self.total_reward += reward
-        env_with_history = self._history.value
-        self.total_q_max += np.max(self.q_values.eval(feed_dict={self.s: env_with_history.reshape((1,) + env_with_history.shape)}))
+        if self.t >= self.INITIAL_REPLAY_SIZE:
+            self.total_q_max += np.max(self.evaluate())
         self.duration += 1
 
         if done:
             # Write summary
             if self.t >= self.INITIAL_REPLAY_SIZE:
-                stats = [self.total_reward, self.total_q_max / float(self.duration),
-                        self.duration, self.total_loss / (float(self.duration) / float(self.TRAIN_INTERVAL))]
-                for i in range(len(stats)):
-                    self.sess.run(self.update_ops[i], feed_dict={
-                        self.summary_placeholders[i]: float(stats[i])
-                    })
-                summary_str = self.sess.run(self.summary_op)
-                self.summary_writer.add_summary(summary_str, self.episode + 1)
+                self.telemetry.scalar('logs/Total Reward/Episode', self.total_reward, self.episode + 1)
+                self.telemetry.scalar('logs/Average Max Q/Episode', self.total_q_max / float(self.duration), self.episode + 1)
+                self.telemetry.scalar('logs/Duration/Episode', self.duration, self.episode + 1)
+                self.telemetry.scalar('logs/Average Loss/Episode',
+                                      self.total_loss / (float(self.duration) / float(self.TRAIN_INTERVAL)), self.episode + 1)
 
             # Debug
             if self.t < self.INITIAL_REPLAY_SIZE:
@@ -309,9 +535,10 @@ class DeepQAgent(object):
 
             # Reset the short term memory
             self._history.reset()
+            self._history_q_values = None
 
         # Append to long term memory
-        self._memory.append(old_state, action, reward, done)
+        self._memory.append(old_state, action, reward, done, action_rewards, action_next_states)
 
     def train(self):
         """ This allows the agent to train itself to better understand the environment dynamics.
@@ -343,8 +570,7 @@ class DeepQAgent(object):
 
                     # Save network
                     if self.t % self.SAVE_INTERVAL == 0:
-                        save_path = self.saver.save(self.sess, self.SAVE_NETWORK_PATH + '/chkpnt', global_step=self.t)
-                        print "Successfully saved:", save_path
+                        self.save_state(self.t + 1) # t is incremented right below
 
                 self.t += 1
 
@@ -352,51 +578,133 @@ class DeepQAgent(object):
         ''' Extension to train() call - Batch generation and graph computations
         '''
         # Sample random minibatch of transition from replay memory
-        state_batch, action_batch, next_state_batch, reward_batch, terminal_batch = self._memory.minibatch(self.BATCH_SIZE)
-
-        target_q_values_batch = self.target_q_values.eval(feed_dict={self.st: next_state_batch})
-        y_batch               = reward_batch + (1 - terminal_batch) * self.GAMMA * np.max(target_q_values_batch, axis=1)
-
-        loss, _ = self.sess.run([self.loss, self.grads_update], feed_dict={
-            self.s: state_batch,
-            self.a: action_batch,
-            self.y: y_batch
-        })
+        with self.telemetry.timer('replay_sample'):
+            if self.PREFETCH:
+                if self._prefetcher is None:
+                    self._prefetcher = MinibatchPrefetcher(self._memory, self.BATCH_SIZE)
+                state_batch, action_batch, next_state_batch, reward_batch, terminal_batch = self._prefetcher.get()
+            else:
+                state_batch, action_batch, next_state_batch, reward_batch, terminal_batch = self._memory.minibatch(self.BATCH_SIZE)
+
+        with self.telemetry.timer('sess_run'):
+            loss, _ = self.sess.run([self.loss, self.grads_update], feed_dict={
+                self.s:  state_batch,
+                self.a:  action_batch,
+                self.st: next_state_batch,
+                self.r:  reward_batch,
+                self.d:  terminal_batch
+            })
+        self.telemetry.count('train_steps')
         self.total_loss += loss
 
-    def setup_summary(self):
-        episode_total_reward = tf.Variable(0.)
-        episode_avg_max_q    = tf.Variable(0.)
-        episode_duration     = tf.Variable(0.)
-        episode_avg_loss     = tf.Variable(0.)
-
-        tf.summary.scalar('logs/Total Reward/Episode', episode_total_reward)
-        tf.summary.scalar('logs/Average Max Q/Episode', episode_avg_max_q)
-        tf.summary.scalar('logs/Duration/Episode', episode_duration)
-        tf.summary.scalar('logs/Average Loss/Episode', episode_avg_loss)
+    def get_weights(self):
+        """ Current Q-network weights as NumPy arrays (keras get_weights() order)
+        """
+        return self.sess.run(self.q_network_weights)
 
-        summary_vars         = [episode_total_reward, episode_avg_max_q, episode_duration, episode_avg_loss]
-        summary_placeholders = [tf.placeholder(tf.float32) for _ in range(len(summary_vars))]
-        update_ops           = [summary_vars[i].assign(summary_placeholders[i]) for i in range(len(summary_vars))]
-        summary_op           = tf.summary.merge_all()
+    def observe_collected(self, count):
+        """ Account for transitions pushed into the replay memory by an ExperienceCollector and
+        train accordingly, keeping the usual ratio of one update every TRAIN_INTERVAL environment steps.
+        """
+        self.telemetry.count('env_steps', count)
+        for _ in range(count):
+            self._num_actions_taken += 1
+            self.train()
 
-        return summary_placeholders, update_ops, summary_op
+    def load_transitions(self, dataset):
+        """ Bulk fill the replay memory with a TransitionDataset (see TransitionDataset.load_dataset())
+        """
+        extra = {}
+        if self.COUNTERFACTUAL_ACTIONS:
+            extra = {'action_rewards': dataset['action_rewards'], 'action_next_states': dataset['action_next_states']}
+        self._memory.extend(dataset['states'], dataset['actions'], dataset['rewards'], dataset['dones'], **extra)
+        print "Replay memory:", len(self._memory), "transitions"
+
+    def train_offline(self, num_updates, log_interval=1000):
+        """ Batch RL - gradient steps back to back on the replay memory, no environment involved.
+        Target update and save intervals keep counting environment steps, one update standing for TRAIN_INTERVAL of them.
+        The agent is closed once done.
+        """
+        loss_since_log = 0.0
+        try:
+            for update in range(1, num_updates + 1):
+                loss_before = self.total_loss
+                self.train_network()
+                loss_since_log += self.total_loss - loss_before
+
+                previous = self.t
+                self.t  += self.TRAIN_INTERVAL
+                if self.t // self.TARGET_UPDATE_INTERVAL != previous // self.TARGET_UPDATE_INTERVAL:
+                    self.sess.run(self.update_target_network)
+                if self.t // self.SAVE_INTERVAL != previous // self.SAVE_INTERVAL:
+                    self.save_state(self.t)
+
+                if update % log_interval == 0:
+                    self.telemetry.scalar('logs/Average Loss/Update', loss_since_log / log_interval, update)
+                    print "UPDATE     :", update, \
+                        "\nTIMESTEP   :", self.t, \
+                        "\nAVG_LOSS   :", loss_since_log / log_interval
+                    loss_since_log = 0.0
+        finally:
+            self.close() # Also on KeyboardInterrupt, flushes the telemetry and the pending checkpoint
+
+    def close(self):
+        """ Stop the prefetcher, finish the pending checkpoint and flush the telemetry, call once training is over
+        """
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+            self._prefetcher = None
+        self.checkpoints.wait()
+        self.telemetry.close()
+
+    def save_state(self, t):
+        """ Snapshot the full training state on this thread and let the CheckpointManager write it in the background.
+        t is the step training resumes at, it also names the checkpoint.
+        """
+        variables   = tf.global_variables()
+        values      = self.sess.run(variables)
+        agent_state = {
+            't'                 : t,
+            'epsilon'           : self.epsilon,
+            'episode'           : self.episode,
+            'num_actions_taken' : self._num_actions_taken,
+        }
+        self.checkpoints.save(t, dict((v.name, value) for v, value in zip(variables, values)),
+                              self._memory.snapshot(), agent_state)
 
     def load_network(self):
+        """ Resume from the latest full training state, or load the Q-network weights of a plain TF checkpoint.
+        Returns True when the full training state (target network included) was restored.
+        """
+        state = self.checkpoints.load()
+        if state is not None:
+            values, memory, agent_state = state
+            for variable in tf.global_variables():
+                if variable.name in values:
+                    variable.load(values[variable.name], self.sess)
+            self._memory.restore(memory)
+            self.t                  = agent_state['t']
+            self.epsilon            = agent_state['epsilon']
+            self.episode            = agent_state['episode']
+            self._num_actions_taken = agent_state['num_actions_taken']
+            print('Successfully resumed: ' + self.checkpoints.latest())
+            return True
+
         checkpoint = tf.train.get_checkpoint_state(self.SAVE_NETWORK_PATH)
         if checkpoint and checkpoint.model_checkpoint_path:
             self.saver.restore(self.sess, checkpoint.model_checkpoint_path)
             print('Successfully loaded: ' + checkpoint.model_checkpoint_path)
         else:
             print('Training new network...')
+        return False
 
     def test(self, state):
         self.t += 1
         self._history.append(state)
+        self._history_q_values = None
 
         if self.t >= self.STATE_LENGTH:
-            env_with_history = self._history.value
-            action = np.argmax(self.q_values.eval(feed_dict={self.s: env_with_history.reshape((1,) + env_with_history.shape)}))
+            action = np.argmax(self.evaluate())
             return action
         return None
 
@@ -467,8 +775,7 @@ def get_iou(bb1, bb2):
 #
 #     return quad_offset, name
 
-def interpret_action_seq(action):
-    step_sizes  = [-40, -20, 0, 20, 40]
+def interpret_action_seq(action, step_sizes=[-40, -20, 0, 20, 40]):
     action_size = len(step_sizes)
     quad_offset = (step_sizes[action%action_size], step_sizes[action/action_size])
     name        = str(quad_offset) + " pixels"
@@ -525,6 +832,42 @@ def is_done(reward):
 def restart_game():
     return env.reset()
 
+def run_episodes(agent, env, step_sizes=[-40, -20, 0, 20, 40], max_steps=None):
+    ''' Single environment training loop, runs forever unless max_steps is given.
+    Returns the (total reward, duration) of every finished episode.
+    '''
+    episodes      = []
+    total_reward  = 0.0
+    duration      = 0
+    steps         = 0
+    current_state = env.reset()
+
+    while max_steps is None or steps < max_steps:
+        action            = agent.act(current_state)
+        # quad_offset, name = interpret_action(action)
+        quad_offset, name = interpret_action_seq(action, step_sizes)
+
+        new_state, reward, done = env.step(quad_offset)
+        if agent.COUNTERFACTUAL_ACTIONS:
+            agent.observe(current_state, action, reward, done, env.action_rewards, env.action_next_states)
+        else:
+            agent.observe(current_state, action, reward, done)
+        agent.train()
+
+        steps        += 1
+        total_reward += reward
+        duration     += 1
+        if done:
+            print "Restarting the Game"
+            episodes.append((total_reward, duration))
+            total_reward, duration = 0.0, 0
+            new_state = env.reset()
+
+        current_state = new_state
+        print "--------------------\n"
+
+    return episodes
+
 
 if __name__=='__main__':
     TEST             = False # False
@@ -537,7 +880,17 @@ if __name__=='__main__':
     im_height        = 720
     #thresh_dim       = (120, 145)
     step_sizes       = [-40, -20, 0, 20, 40]
+    hot_reload       = False # Test - swap in new checkpoints of SAVE_NETWORK_PATH without restarting
+    streaming        = False # Test - carry the LSTM state between decisions, cheaper but only exact on resync steps
     max_guided_eps   = 2000
+    num_workers      = 0 # Experience collection processes, 0 steps a single environment on the learner thread
+    broadcast_every  = 1000 # Transitions between two weight broadcasts to the workers
+    render           = True # Save the annotated training frames (EnvironmentSeq only)
+    all_actions      = False # Learn from the outcome of all 25 actions at every step (EnvironmentSeq only)
+    dataset_path     = None # TransitionDataset directory, trains offline from it instead of stepping EnvironmentSeq
+    offline_updates  = 1000000 # Gradient steps of offline training
+    record_path      = None # Test - log the whole real-time session to this file
+    replay_path      = None # Test - run from a recorded session instead of AirSim, faster than real time
 
 
     # gt_box = np.array([ (im_height/2.0 - thresh_dim[1]/2.0) / im_height,
@@ -545,46 +898,82 @@ if __name__=='__main__':
     #                     (im_height/2.0 + thresh_dim[1]/2.0) / im_height,
     #                     (im_width/2.0 + thresh_dim[0]/2.0) / im_width])
 
-    agent = DeepQAgent((num_buff_frames, input_dims), num_actions)
-
-    if not TEST:
+    if not TEST and num_workers > 0:
+        # Train - N EnvironmentSeq workers feed the replay memory, this process only learns
+        agent = DeepQAgent((num_buff_frames, input_dims), num_actions)
+
+        from EnvironmentSeq import EnvironmentSeq
+
+        def make_env(worker_id):
+            env = EnvironmentSeq(image_shape=(im_height, im_width), step_sizes=step_sizes, max_guided_eps=max_guided_eps, render=False)
+            env.current_sequence = worker_id % len(env._sequences)
+            return env
+
+        collector = ExperienceCollector(make_env, interpret_action_seq, num_workers, (input_dims,), num_actions,
+                                        [w.shape for w in agent.get_weights()], history_length=num_buff_frames)
+        collector.start(agent.get_weights())
+        last_broadcast = 0
+
+        try:
+            while True:
+                collected = collector.drain(agent._memory)
+                if not collected:
+                    time.sleep(0.01)
+                    continue
+                agent.observe_collected(collected)
+
+                for worker_id, epsilon, total_reward, duration in collector.episode_stats():
+                    agent.episode += 1
+                    print "WORKER", worker_id, "EPISODE", agent.episode, "EPSILON", epsilon, \
+                        "TOTALREWARD", total_reward, "DURATION", duration
+
+                if agent._num_actions_taken - last_broadcast >= broadcast_every:
+                    collector.broadcast(agent.get_weights())
+                    last_broadcast = agent._num_actions_taken
+        finally:
+            collector.stop()
+            agent.close()
+    elif not TEST and dataset_path:
+        # Train offline - bulk load the precomputed transitions (python TransitionDataset.py) and only run updates
+        from TransitionDataset import load_dataset
+        dataset = load_dataset(dataset_path)
+        DeepQAgent.COUNTERFACTUAL_ACTIONS = all_actions
+        DeepQAgent.MEMORY_SIZE            = max(DeepQAgent.MEMORY_SIZE, dataset['meta']['size'])
+        agent = DeepQAgent((num_buff_frames, input_dims), num_actions)
+        agent.load_transitions(dataset)
+        agent.train_offline(offline_updates)
+    elif not TEST:
         # Train
+        DeepQAgent.COUNTERFACTUAL_ACTIONS = all_actions
+        agent         = DeepQAgent((num_buff_frames, input_dims), num_actions)
         # env           = Environment(gt_box=gt_box)
-        env           = EnvironmentSeq(image_shape=(im_height, im_width), step_sizes=step_sizes, max_guided_eps=max_guided_eps)
-        current_state = env.reset()
-
-        while True:
-            action            = agent.act(current_state)
-            # quad_offset, name = interpret_action(action)
-            quad_offset, name = interpret_action_seq(action)
-
-            new_state, reward, done = env.step(quad_offset)
-            # print "Action     :", action, name
-            # print "Reward     :", reward
-            # print "Done       :", done
-            # try:
-            #     # new_state, collision_info = env.step(quad_offset, duration=2)
-            #     # reward = compute_reward(new_state, collision_info, max_dist=max_dist, thresh_dim=thresh_dim)
-            #     # done   = is_done(reward)
-            #     new_state, reward, done = env.step(quad_offset)
-            # except:
-            #     reward = -100.0
-            #     done   = 1
-            agent.observe(current_state, action, reward, done)
-            agent.train()
-
-            if done:
-                print "Restarting the Game"
-                new_state = restart_game()
-
-            current_state = new_state
-            print "--------------------\n"
+        from EnvironmentSeq import EnvironmentSeq
+        env           = EnvironmentSeq(image_shape=(im_height, im_width), step_sizes=step_sizes, max_guided_eps=max_guided_eps,
+                                       render=render, all_actions=all_actions)
+        try:
+            run_episodes(agent, env, step_sizes)
+        finally:
+            agent.close()
     else:
-        # Test
-        env = EnvironmentSeqRT(image_shape=(im_height, im_width), step_sizes=step_sizes)
+        # Test - pure NumPy forward pass, no TF graphs, optimizer or session are built for deployment
+        policy_path = os.path.join(DeepQAgent.SAVE_NETWORK_PATH, 'policy.npz')
+        from ExportPolicy import export_if_stale
+        export_if_stale(DeepQAgent.SAVE_NETWORK_PATH, policy_path)
+        agent = NumpyPolicy.load(policy_path, streaming=streaming)
+        if hot_reload:
+            from CheckpointWatcher import CheckpointWatcher
+            watcher = CheckpointWatcher(DeepQAgent.SAVE_NETWORK_PATH)
+
+        from EnvironmentSeqRT import EnvironmentSeqRT
+        env = EnvironmentSeqRT(image_shape=(im_height, im_width), step_sizes=step_sizes,
+                               record=record_path, replay=replay_path)
         current_state = env.reset()
 
         while True:
+            if hot_reload:
+                weights = watcher.poll()
+                if weights is not None:
+                    agent.set_weights(weights)
             action = agent.test(current_state)
             quad_offset = None
             if action is not None:
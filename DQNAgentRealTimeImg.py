@@ -1,14 +1,16 @@
 # from Environment import Environment
 # from EnvironmentSeq import EnvironmentSeq
 from EnvironmentRealTimeImg import EnvironmentRealTime
+from CaptureProfile import CaptureProfile
+from NumpyPolicy import NumpyPolicy, History
+from LazyModule import LazyModule
 
 import os
 import random
 import numpy as np
-import tensorflow as tf
 from collections import deque
-from keras.models import Sequential
-from keras.layers import Convolution2D, Flatten, Dense, LSTM
+
+tf = LazyModule('tensorflow')
 
 class ReplayMemory(object):
     """
@@ -102,32 +104,6 @@ class ReplayMemory(object):
             return self._states.take(indexes, mode='wrap', axis=0)
 
 
-class History(object):
-    """
-    Accumulator keeping track of the N previous frames to be used by the agent
-    for evaluation
-    """
-    def __init__(self, shape):
-        self._buffer = np.zeros(shape, dtype=np.float32)
-
-    @property
-    def value(self):
-        """ Underlying buffer with N previous states stacked along first axis
-        """
-        return self._buffer
-
-    def append(self, state):
-        """ Append state to the history
-        """
-        self._buffer[:-1] = self._buffer[1:]
-        self._buffer[-1]  = state
-
-    def reset(self):
-        """ Reset the memory. Underlying buffer set all indexes to 0
-        """
-        self._buffer.fill(0)
-
-
 class DeepQAgent(object):
     """
     Implementation of Deep Q Neural Network agent like in:
@@ -205,6 +181,9 @@ class DeepQAgent(object):
         self.sess.run(self.update_target_network)
 
     def build_network(self, input_shape):
+        from keras.models import Sequential
+        from keras.layers import Dense, LSTM
+
         model = Sequential()
         model.add(LSTM(16, input_shape=input_shape)) # 32
         model.add(Dense(32, activation='relu')) # 64
@@ -536,14 +515,28 @@ if __name__=='__main__':
     im_height        = 720
     #thresh_dim       = (120, 145)
     step_sizes       = [-40, -20, 0, 20, 40]
+    hot_reload       = False # Test - swap in new checkpoints of SAVE_NETWORK_PATH without restarting
+    streaming        = False # Test - carry the LSTM state between decisions, cheaper but only exact on resync steps
     max_guided_eps   = 1000
+    record_path      = None # Log the whole session (frames, detections, kinematics, controls) to this file
+    replay_path      = None # Run from a recorded session instead of AirSim, faster than real time
+    lockstep         = False # Pause the simulator between frames, one control period per step
+    detection_size   = None # (width, height) fed to the detector, e.g. (300, 300) with a camera rendering at that size
+    record_full_res  = False # Also fetch full resolution frames (current_recording) for the session log
+    view_cameras     = None # Cameras detected as one batch, in order of preference, e.g. [3, 0] downward then front
 
+    detection_profile = CaptureProfile(size=detection_size) if detection_size else None
+    recording_profile = CaptureProfile() if record_full_res else None
+    view_profiles     = [CaptureProfile(camera_id, detection_size) for camera_id in view_cameras] if view_cameras else None
 
-    agent = DeepQAgent((num_buff_frames, input_dims), num_actions)
 
     if not TEST:
         # Train
-        env           = EnvironmentRealTime(image_shape=(im_height, im_width), step_sizes=step_sizes, max_guided_eps=max_guided_eps)
+        agent         = DeepQAgent((num_buff_frames, input_dims), num_actions)
+        env           = EnvironmentRealTime(image_shape=(im_height, im_width), step_sizes=step_sizes, max_guided_eps=max_guided_eps,
+                                            record=record_path, replay=replay_path, lockstep=lockstep,
+                                            detection_profile=detection_profile, recording_profile=recording_profile,
+                                            view_profiles=view_profiles)
         current_state = env.reset()
 
         while True:
@@ -560,11 +553,26 @@ if __name__=='__main__':
             current_state = new_state
             print "--------------------\n"
     else:
-        # Test
-        env = EnvironmentRealTime(image_shape=(im_height, im_width), step_sizes=step_sizes)
+        # Test - pure NumPy forward pass, no TF graphs, optimizer or session are built for deployment
+        policy_path = os.path.join(DeepQAgent.SAVE_NETWORK_PATH, 'policy.npz')
+        from ExportPolicy import export_if_stale
+        export_if_stale(DeepQAgent.SAVE_NETWORK_PATH, policy_path)
+        agent = NumpyPolicy.load(policy_path, streaming=streaming)
+        if hot_reload:
+            from CheckpointWatcher import CheckpointWatcher
+            watcher = CheckpointWatcher(DeepQAgent.SAVE_NETWORK_PATH)
+
+        env = EnvironmentRealTime(image_shape=(im_height, im_width), step_sizes=step_sizes,
+                                  record=record_path, replay=replay_path, lockstep=lockstep,
+                                  detection_profile=detection_profile, recording_profile=recording_profile,
+                                  view_profiles=view_profiles)
         current_state = env.reset()
 
         while True:
+            if hot_reload:
+                weights = watcher.poll()
+                if weights is not None:
+                    agent.set_weights(weights)
             action = agent.test(current_state)
             quad_offset = None
             if action is not None:
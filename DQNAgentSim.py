@@ -434,13 +434,14 @@ if __name__=='__main__':
     im_width         = 1280
     im_height        = 720
     max_guided_eps   = 1000
+    lockstep         = False # Pause the simulator between decisions, train faster than real time
 
 
     agent = DeepQAgent((num_buff_frames, input_dims), num_actions)
 
     if not TEST:
         # Train
-        env           = EnvironmentSim(image_shape=(im_height, im_width), max_guided_eps=max_guided_eps)
+        env           = EnvironmentSim(image_shape=(im_height, im_width), max_guided_eps=max_guided_eps, lockstep=lockstep)
         current_state = env.reset()
 
         while True:
@@ -459,7 +460,7 @@ if __name__=='__main__':
             print "--------------------\n"
     else:
         # Test
-        env           = EnvironmentSim(image_shape=(im_height, im_width))
+        env           = EnvironmentSim(image_shape=(im_height, im_width), lockstep=lockstep)
         current_state = env.reset()
 
         while True:
@@ -1,35 +1,145 @@
-
 import os
 import sys
+import json
 import time
+import argparse
+import numpy as np
+import multiprocessing as mp
+from collections import deque
+
+from MultiRotorConnector import MultiRotorConnector
+
+def write_png(path, frame):
+    from PIL import Image
+    Image.fromarray(frame).save(path)
+
+def write_shard(path, frames):
+    np.save(path, frames)
+
+class FrameWriter(object):
+    """
+    Hands frames to a pool of writer processes so that PNG compression / disk writes never hold up the capture loop.
+    fmt='png' writes one <index>.png per frame, fmt='npy' stacks `shard_size` frames per shard_<first index>.npy.
+    At most `max_pending` writes are in flight, write() then waits for the oldest one (and raises its error if any).
+    """
+    def __init__(self, directory, fmt='png', workers=None, shard_size=100, max_pending=None):
+        if fmt not in ('png', 'npy'):
+            raise Exception('Unknown frame format: ' + fmt)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory   = directory
+        self.fmt         = fmt
+        self.shard_size  = shard_size
+        self.workers     = workers or mp.cpu_count()
+        self.max_pending = max_pending or 4 * self.workers
+        self._pool       = mp.Pool(self.workers)
+        self.frames      = 0
+        self._pending    = deque()
+        self._shard      = None
+        self._shard_rows = 0
+        self._shard_path = None
+
+    def _submit(self, fn, *args):
+        while len(self._pending) >= self.max_pending:
+            self._pending.popleft().get()
+        self._pending.append(self._pool.apply_async(fn, args))
+
+    def write(self, index, frame):
+        """ Queue the frame, returns (file, row in the file) for the metadata, row is None for PNGs
+        """
+        self.frames += 1
+        if self.fmt == 'png':
+            path = os.path.join(self.directory, str(index).zfill(6) + '.png')
+            self._submit(write_png, path, frame)
+            return os.path.basename(path), None
+
+        if self._shard is None:
+            self._shard      = np.empty((self.shard_size,) + frame.shape, dtype=frame.dtype)
+            self._shard_rows = 0
+            self._shard_path = os.path.join(self.directory, 'shard_' + str(index).zfill(6) + '.npy')
+        row = self._shard_rows
+        self._shard[row]  = frame
+        self._shard_rows += 1
+        name = os.path.basename(self._shard_path)
+        if self._shard_rows == self.shard_size:
+            self.flush()
+        return name, row
+
+    def flush(self):
+        """ Hand the partial shard to the writers
+        """
+        if self._shard is not None:
+            self._submit(write_shard, self._shard_path, self._shard[:self._shard_rows])
+            self._shard = None
+
+    def close(self):
+        """ Flush and wait for every queued write
+        """
+        self.flush()
+        while self._pending:
+            self._pending.popleft().get()
+        self._pool.close()
+        self._pool.join()
+
+
+def altitude_schedule(start_z, z_step, altitudes=None):
+    ''' Altitude of every level of the sweep, endless when altitudes is None
+    '''
+    level = 0
+    while altitudes is None or level < altitudes:
+        yield start_z + level * z_step
+        level += 1
+
+def capture(connector, writer, metadata, start_index, schedule, frames_per_altitude, camera_id=3):
+    ''' Fly the altitude sweep, the altitude changes whenever the frame number reaches a multiple of
+    frames_per_altitude (so the first level is shorter when start_index is not one). Every frame gets a metadata
+    line with its file, the capture time and the drone pose of the same tick.
+    '''
+    count = start_index
+    for z in schedule:
+        print count, z
+        if not connector.move_to_position((0, 0, z)).wait():
+            print "Altitude", z, "not reached, capturing anyway"
+
+        for _ in range(frames_per_altitude - count % frames_per_altitude):
+            snapshot  = connector.snapshot(camera_id)
+            name, row = writer.write(count, snapshot.frame)
+            position, orientation = snapshot.position, snapshot.orientation
+            metadata.write(json.dumps({'index': count, 'file': name, 'row': row, 'time': snapshot.time, 'altitude': z,
+                                       'position': [position.x_val, position.y_val, position.z_val],
+                                       'orientation': [orientation.w_val, orientation.x_val,
+                                                       orientation.y_val, orientation.z_val]}) + '\n')
+            count += 1
+    return count
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Capture detector training frames over an altitude sweep')
+    parser.add_argument('--out', default='data/detector')
+    parser.add_argument('--start-index', type=int, default=3000, help='Number of the first frame')
+    parser.add_argument('--start-z', type=float, default=-19.0, help='First altitude (NED, negative is up)')
+    parser.add_argument('--z-step', type=float, default=-3.0, help='Altitude change between levels')
+    parser.add_argument('--frames-per-altitude', type=int, default=400)
+    parser.add_argument('--altitudes', type=int, default=None, help='Levels of the sweep, endless by default')
+    parser.add_argument('--camera', type=int, default=3, help='0-4: front, left, right, downward, rear')
+    parser.add_argument('--format', choices=['png', 'npy'], default='png')
+    parser.add_argument('--shard-size', type=int, default=100, help='Frames per .npy shard')
+    parser.add_argument('--workers', type=int, default=None, help='Writer processes, one per CPU by default')
+    args = parser.parse_args()
+
+    writer    = FrameWriter(args.out, args.format, args.workers, args.shard_size) # Fork before connecting
+    connector = MultiRotorConnector()
+    connector.client.armDisarm(True)
+    connector.client.takeoff()
 
-python_path = os.path.abspath('AirSim/PythonClient')
-sys.path.append(python_path)
-from AirSimClient import *
-
-client = MultirotorClient()
-client.confirmConnection()
-client.enableApiControl(True)
-client.armDisarm(True)
-
-INITZ = -19
-client.takeoff()
-client.moveToPosition(0, 0, INITZ, 5)
-time.sleep(5)
-
-count = 3000
-print "BEGIN"
-while(True):
-    path = 'data/detector/' + str(count).zfill(6) + '.png'
-    response = client.simGetImages([ImageRequest(3, AirSimImageType.Scene, False, False)])[0]
-    img1d = np.fromstring(response.image_data_uint8, dtype=np.uint8) # get numpy array
-    img_rgba = img1d.reshape(response.height, response.width, 4) # reshape array to 4 channel image array H X W X 4
-    img_rgba = np.flipud(img_rgba) # original image is fliped vertically
-    client.write_png(os.path.normpath(path), img_rgba)
-
-    count += 1
-    if count%400==0:
-        print count, INITZ
-        INITZ -= 3
-        client.moveToPosition(0, 0, INITZ, 5)
-        time.sleep(5)
+    schedule = altitude_schedule(args.start_z, args.z_step, args.altitudes)
+    start    = time.time()
+    print "BEGIN"
+    try:
+        with open(os.path.join(args.out, 'metadata.jsonl'), 'a') as metadata:
+            capture(connector, writer, metadata, args.start_index, schedule, args.frames_per_altitude, args.camera)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+    print writer.frames, "frames in %.1f s" % (time.time() - start)
@@ -1,18 +1,12 @@
 import os
 import sys
-import cv2
-import tarfile
-import zipfile
 import numpy as np
 import tensorflow as tf
-import six.moves.urllib as urllib
-
-import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
 
 from PIL import Image
 
+from LazyModule import LazyModule
+
 python_path = os.path.abspath('TF_ObjectDetection')
 sys.path.append(python_path)
 python_path = os.path.abspath('TF_ObjectDetection/slim')
@@ -23,7 +17,7 @@ if tf.__version__ < '1.5.0':
     raise ImportError('Please upgrade your tensorflow installation to v1.5.* or later!')
 
 from object_detection.utils import label_map_util
-from object_detection.utils import visualization_utils as vis_util
+vis_util = LazyModule('object_detection.utils.visualization_utils')
 
 class Detector:
     MODEL_NAME = 'ssd_mobilenet_v1_coco'
@@ -35,6 +29,7 @@ class Detector:
 
     fig              = None
     min_score_thresh = 0.25
+    render           = False # Draw the detections on a copy of the frame (only useful with the cv2.imshow below)
 
     def __init__(self):
         if not os.path.isfile(self.PATH_TO_CKPT):
@@ -127,40 +122,76 @@ class Detector:
             mpimg.imsave(image_path.split('/')[-1], image_np)
 
     def detect(self, image_np, gt_box=None):
-        image = image_np.copy()
         # image_np_expanded = np.expand_dims(image_np, axis=0)
         output_dict = self.run_inference_for_single_image(image_np)
 
-        if gt_box is not None:
-            vis_util.draw_bounding_boxes_on_image_array( image,
-                                                         np.array([gt_box]),
-                                                         color='black',
-                                                         thickness=4)
-
-        # Visualization of the results of a detection.
-        vis_util.visualize_boxes_and_labels_on_image_array( image,
-                                                            output_dict['detection_boxes'],
-                                                            output_dict['detection_classes'],
-                                                            output_dict['detection_scores'],
-                                                            self.category_index,
-                                                            min_score_thresh=self.min_score_thresh,
-                                                            instance_masks=output_dict.get('detection_masks'),
-                                                            use_normalized_coordinates=True,
-                                                            skip_scores=False,
-                                                            skip_labels=True,
-                                                            line_thickness=4)
-        # cv2.imshow('Simulation', image)
-        # cv2.waitKey(10)
-
-        bboxes  = output_dict['detection_boxes']
-        classes = output_dict['detection_classes']
-        scores  = output_dict['detection_scores']
+        if self.render:
+            image = image_np.copy()
+            if gt_box is not None:
+                vis_util.draw_bounding_boxes_on_image_array( image,
+                                                             np.array([gt_box]),
+                                                             color='black',
+                                                             thickness=4)
+
+            # Visualization of the results of a detection.
+            vis_util.visualize_boxes_and_labels_on_image_array( image,
+                                                                output_dict['detection_boxes'],
+                                                                output_dict['detection_classes'],
+                                                                output_dict['detection_scores'],
+                                                                self.category_index,
+                                                                min_score_thresh=self.min_score_thresh,
+                                                                instance_masks=output_dict.get('detection_masks'),
+                                                                use_normalized_coordinates=True,
+                                                                skip_scores=False,
+                                                                skip_labels=True,
+                                                                line_thickness=4)
+            # cv2.imshow('Simulation', image)
+            # cv2.waitKey(10)
+
+        im_height, im_width = image_np.shape[0:2]
+        return self.car_box(output_dict['detection_boxes'], output_dict['detection_classes'],
+                            output_dict['detection_scores'], im_height, im_width)
+
+    def run_inference_for_batch(self, images):
+        """ One inference run over a stack of same size images (N x H x W x 3), the outputs keep the batch dimension.
+        Masks are not reframed, the SSD model has none.
+        """
+        with self.detection_graph.as_default():
+            with tf.Session() as sess:
+                tensor_dict      = {}
+                ops              = tf.get_default_graph().get_operations()
+                all_tensor_names = {output.name for op in ops for output in op.outputs}
+                for key in ['num_detections', 'detection_boxes', 'detection_scores', 'detection_classes']:
+                    tensor_name = key + ':0'
+                    if tensor_name in all_tensor_names:
+                        tensor_dict[key] = tf.get_default_graph().get_tensor_by_name(tensor_name)
+                image_tensor = tf.get_default_graph().get_tensor_by_name('image_tensor:0')
+
+                output_dict = sess.run(tensor_dict, feed_dict={image_tensor: images})
 
+        output_dict['num_detections']    = output_dict['num_detections'].astype(np.int32)
+        output_dict['detection_classes'] = output_dict['detection_classes'].astype(np.uint8)
+        return output_dict
+
+    def detect_batch(self, images):
+        """ detect() on the frames of several cameras in a single inference run, one output (or None) per frame.
+        The frames must have the same size.
+        """
+        if len(set(image.shape for image in images)) != 1:
+            raise Exception('Batched detection needs frames of the same size')
+        output_dict = self.run_inference_for_batch(np.stack(images))
+
+        im_height, im_width = images[0].shape[0:2]
+        return [self.car_box(output_dict['detection_boxes'][i], output_dict['detection_classes'][i],
+                             output_dict['detection_scores'][i], im_height, im_width) for i in range(len(images))]
+
+    def car_box(self, bboxes, classes, scores, im_height, im_width):
+        """ Best scoring car as (POS_X, POS_Y, WIDTH, HEIGHT) in pixels from the image center (y up), None if none
+        """
         bboxes   = [bbox for bbox, _ in sorted(zip(bboxes, scores), key=lambda pair: pair[1], reverse=True)]
         classes  = [clss for clss, _ in sorted(zip(classes, scores), key=lambda pair: pair[1], reverse=True)]
         scores   = sorted(scores, key=lambda x: x, reverse=True)
 
-        im_height, im_width = image_np.shape[0:2]
         for i in range(len(bboxes)):
           if scores is None or scores[i] > self.min_score_thresh:
             if classes[i] in self.category_index.keys():
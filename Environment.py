@@ -36,15 +36,18 @@ class Environment:
         return out
 
     def update(self, state):
-        velocity = self._connector.get_velocity()
+        # Kinematics, collision info and frame of this tick in a single round trip
+        snapshot = self._connector.snapshot()
+
+        velocity = snapshot.velocity
         state.VEL_X = velocity.x_val
         state.VEL_Y = velocity.y_val
         state.VEL_Z = velocity.z_val
 
-        position = self._connector.get_position()
+        position = snapshot.position
         state.ALTITUDE = position.z_val
 
-        frame        = self._connector.get_frame()
+        frame        = snapshot.frame
         output       = self._detector.detect(frame, self.gt_box)
         if not output:
             return None
@@ -70,7 +73,7 @@ class Environment:
         car_pos, car_ort = self._car_connector.reset()
 
         offset = (car_pos.x_val, car_pos.y_val, self._connector.INIT_Z)
-        self._connector.move_to_position(offset)
+        self._connector.move_to_position(offset).wait()
         # self._connector.move_to_position(offset, yaw_mode=YawMode(is_rate= False, yaw_or_rate=0.0))
         # time.sleep(3)
 
@@ -84,9 +87,9 @@ class Environment:
 
     def step(self, action, duration=5):
         _state = State()
-        self._connector.move_by_velocity(action, duration=duration)
-        collision_info = self._connector.get_collision_info()
+        self._connector.move_by_velocity(action, duration=duration).wait()
         flag = self.update(_state)
+        collision_info = self._connector.get_collision_info()
         if not flag:
             raise Exception('Unable to detect any Object')
         return self.state_to_array(_state), collision_info
@@ -1,20 +1,18 @@
 import os
 import sys
-import cv2
 import time
 import numpy as np
-import matplotlib.pyplot as plt
 
 from PIL import Image
 import xml.etree.ElementTree as ET
 
+from LazyModule import LazyModule
+
 python_path = os.path.abspath('TF_ObjectDetection')
 sys.path.append(python_path)
-from object_detection.utils import visualization_utils as vis_util
+vis_util = LazyModule('object_detection.utils.visualization_utils')
 
-from Detector import Detector
-from MultiRotorConnector import MultiRotorConnector
-from CarConnector import CarConnector
+from SessionLog import SessionWriter, SessionReader, Recorder, Replayer
 
 class State():
     DELTA_X    = 0.0
@@ -22,7 +20,9 @@ class State():
     pass
 
 class EnvironmentRealTime:
-    def __init__(self, image_shape=(720, 1280), step_sizes=[-40, -20, 0, 20, 40], max_guided_eps=1000):
+    def __init__(self, image_shape=(720, 1280), step_sizes=[-40, -20, 0, 20, 40], max_guided_eps=1000,
+                 record=None, replay=None, lockstep=False, detection_profile=None, recording_profile=None,
+                 view_profiles=None):
         self.current_episode = 0
         self.max_guided_eps  = max_guided_eps
 
@@ -39,16 +39,82 @@ class EnvironmentRealTime:
 
         self.current_frame    = None
         self.current_output   = None
-
-        self._detector      = Detector()
-        self._connector     = MultiRotorConnector()
-        self._car_connector = CarConnector()
-
-        self.old_x = None
-        self.old_y = None
+        self.current_recording = None # Full resolution frame of the recording profile, if any
+
+        # CaptureProfile of the detector input (e.g. a 300x300 camera or a region), detections are mapped back
+        # to image_shape coordinates; recording_profile adds a full resolution frame per tick for recording only
+        self.detection_profile = detection_profile
+
+        # CaptureProfiles of several cameras (e.g. downward, then front) fetched in one request and detected as one
+        # batch instead of the detection profile, the target is tracked in the first view holding it
+        self.view_profiles = view_profiles
+        self.current_view  = None # Camera id of the view holding the target
+
+        # record - log every connector / detector interaction to this session file
+        # replay - run from a recorded session instead of AirSim and the detector, as fast as possible
+        self._session = None
+        if replay is not None:
+            self._session       = SessionReader(replay)
+            self._detector      = Replayer(self._session, 'detector')
+            self._connector     = Replayer(self._session, 'drone')
+            self._car_connector = Replayer(self._session, 'car')
+        else:
+            # TF and AirSim are only imported for live sessions, replay needs neither
+            from Detector import Detector
+            from MultiRotorConnector import MultiRotorConnector
+            from CarConnector import CarConnector
+            self._detector      = Detector()
+            self._connector     = MultiRotorConnector(lockstep=lockstep, detection_profile=detection_profile,
+                                                      recording_profile=recording_profile)
+            self._car_connector = CarConnector()
+            if record is not None:
+                self._session       = SessionWriter(record)
+                self._detector      = Recorder(self._detector, self._session, 'detector', log_args=False)
+                self._connector     = Recorder(self._connector, self._session, 'drone')
+                self._car_connector = Recorder(self._car_connector, self._session, 'car')
+
+        self.lockstep = lockstep # One control period of simulated time between two frames, see MultiRotorConnector
+        self.old_x    = None
+        self.old_y    = None
 
         self.TEST  = False
 
+    def close(self):
+        """ Flush and close the recorded / replayed session
+        """
+        if self._session is not None:
+            self._session.close()
+
+    def _detect(self):
+        """ Capture the next detection frame (and recording frame, kept in current_recording) and detect the car.
+        The detection is returned in image_shape pixel coordinates whatever the detection profile.
+        """
+        if self.view_profiles:
+            return self._detect_views()
+        frame, self.current_recording = self._connector.capture()
+        output = self._detector.detect(frame)
+        if output and self.detection_profile is not None:
+            output = self.detection_profile.to_frame(output, frame.shape, (self.im_height, self.im_width))
+        return frame, output
+
+    def _detect_views(self):
+        """ _detect() over every view profile, one simGetImages call and one detector batch. The view that held
+        the target last tick keeps it while it still sees it, otherwise the first view seeing it takes over.
+        """
+        frames  = self._connector.capture_views(self.view_profiles)
+        outputs = self._detector.detect_batch(frames)
+        seen    = [i for i, output in enumerate(outputs) if output]
+        if not seen:
+            self.current_view = None
+            return frames[0], None
+
+        ids  = [profile.camera_id for profile in self.view_profiles]
+        view = ids.index(self.current_view) if self.current_view in ids and outputs[ids.index(self.current_view)] \
+               else seen[0]
+        self.current_view = ids[view]
+        output = self.view_profiles[view].to_frame(outputs[view], frames[view].shape, (self.im_height, self.im_width))
+        return frames[view], output
+
     def state_to_array(self, state):
         out = np.zeros((2,), dtype='float32')
         out[0] = float(state.DELTA_X)/float(self.im_width)
@@ -64,10 +130,9 @@ class EnvironmentRealTime:
 
         car_pos, car_ort = self._car_connector.reset()
         offset = (car_pos.x_val, car_pos.y_val, self._connector.INIT_Z)
-        self._connector.move_to_position(offset)
+        self._connector.move_to_position(offset).wait()
 
-        frame        = self._connector.get_frame()
-        output       = self._detector.detect(frame)
+        frame, output = self._detect()
         if not output:
             raise Exception('Unable to Detect')
         POS_X1  = output[0]
@@ -76,8 +141,7 @@ class EnvironmentRealTime:
         HEIGHT1 = output[3]
 
 
-        frame        = self._connector.get_frame()
-        output       = self._detector.detect(frame)
+        frame, output = self._detect()
         if not output:
             raise Exception('Unable to Detect')
         POS_X2  = output[0]
@@ -230,9 +294,11 @@ class EnvironmentRealTime:
             self.old_gy = POS_Y
 
         # NEXT frame
+        if self.lockstep:
+            self._connector.advance()
         _state = State()
-        frame        = self._connector.get_frame()
-        output       = self._detector.detect(frame)
+        view          = self.current_view
+        frame, output = self._detect()
         if (not output) or reward<=self.min_reward:
             done   = 1
             reward = -20.0
@@ -242,6 +308,12 @@ class EnvironmentRealTime:
             WIDTH  = output[2]
             HEIGHT = output[3]
 
+            if self.current_view != view:
+                # Target handed over to another camera, its image coordinates start over
+                print "View       :", view, "->", self.current_view
+                self.old_x = self.old_gx = POS_X
+                self.old_y = self.old_gy = POS_Y
+
             _state.DELTA_X = POS_X - self.old_x
             _state.DELTA_Y = POS_Y - self.old_y
 
@@ -1,16 +1,16 @@
 import os
 import sys
-import cv2
 import time
 import numpy as np
-import matplotlib.pyplot as plt
 
 from PIL import Image
 import xml.etree.ElementTree as ET
 
+from LazyModule import LazyModule
+
 python_path = os.path.abspath('TF_ObjectDetection')
 sys.path.append(python_path)
-from object_detection.utils import visualization_utils as vis_util
+vis_util = LazyModule('object_detection.utils.visualization_utils')
 
 # from Detector import Detector
 
@@ -20,7 +20,8 @@ class State():
     pass
 
 class EnvironmentSeq:
-    def __init__(self, image_shape=(720, 1280), step_sizes=[-40, -20, 0, 20, 40], max_guided_eps=1000):
+    def __init__(self, image_shape=(720, 1280), step_sizes=[-40, -20, 0, 20, 40], max_guided_eps=1000, render=True,
+                 all_actions=False):
         self.ncols = 45
         self.nrows = 45
 
@@ -33,10 +34,18 @@ class EnvironmentSeq:
         self.step_sizes = step_sizes
 
         self.fig        = None
+        self.render     = render # Draw the boxes and save them to data/output_train, frames are only read when rendering
         self.max_dist   = np.linalg.norm([self.im_width, self.im_height])
         self.SCALE_IOU  = 8.0
         self.SCALE_DIST = 1.0
 
+        # Rewards only depend on the recorded boxes, so with all_actions every step also evaluates all the
+        # (step_x, step_y) offsets (interpret_action_seq order) into action_rewards / action_next_states
+        self.all_actions        = all_actions
+        self.action_offsets     = np.array([(x, y) for y in step_sizes for x in step_sizes], dtype=np.int64)
+        self.action_rewards     = None
+        self.action_next_states = None
+
         self.current_sequence = 0
         self.current_frame    = 0
         self.length_sequences = []
@@ -68,7 +77,6 @@ class EnvironmentSeq:
         self.current_frame = 0
         file    = 'data/' + str(self._sequences[self.current_sequence]) + '/' + \
                   str(self.frames_sequences[self.current_sequence][self.current_frame])
-        frame   = np.asarray(Image.open(file.split('.')[0] + '.png').convert('RGB'), dtype=np.uint8).copy()
         det_box = None
         with open(file.split('.')[0] + '.txt', 'rb') as f:
             xmint, xmaxt, ymint, ymaxt = [int(float(x)) for x in f.readline().split()]
@@ -87,7 +95,6 @@ class EnvironmentSeq:
         self.current_frame = 1
         file    = 'data/' + str(self._sequences[self.current_sequence]) + '/' + \
                   str(self.frames_sequences[self.current_sequence][self.current_frame])
-        frame   = np.asarray(Image.open(file.split('.')[0] + '.png').convert('RGB'), dtype=np.uint8).copy()
         det_box = None
         with open(file.split('.')[0] + '.txt', 'rb') as f:
             xmint, xmaxt, ymint, ymaxt = [int(float(x)) for x in f.readline().split()]
@@ -141,12 +148,38 @@ class EnvironmentSeq:
         assert iou <= 1.0
         return iou
 
+    def box_rewards(self, gt_box, centers_x, centers_y, width, height):
+        """ Vectorized reward of step() for agent boxes of the given size centered on each (centers_x, centers_y)
+        """
+        x1 = centers_x - width/2
+        x2 = centers_x + width/2
+        y1 = centers_y + height/2
+        y2 = centers_y - height/2
+
+        x_left   = np.maximum(x1, gt_box['x1'])
+        y_top    = np.minimum(y1, gt_box['y1'])
+        x_right  = np.minimum(x2, gt_box['x2'])
+        y_bottom = np.maximum(y2, gt_box['y2'])
+
+        intersection_area = (x_right - x_left) * (y_bottom - y_top)
+        gt_area           = (gt_box['x2'] - gt_box['x1']) * (gt_box['y2'] - gt_box['y1'])
+        box_area          = (x2 - x1) * (y2 - y1)
+        union_area        = (gt_area + box_area - intersection_area).astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            iou = intersection_area / union_area
+        # No overlap is 0 like in get_iou, and so is the 0/0 of empty boxes
+        iou[(x_right < x_left) | (y_bottom > y_top) | (union_area == 0)] = 0.0
+
+        dist_x = (x1 + x2)/2.0 - float(gt_box['x1'] + gt_box['x2'])/2.0
+        dist_y = (y1 + y2)/2.0 - float(gt_box['y1'] + gt_box['y2'])/2.0
+        dist   = np.sqrt(dist_x**2 + dist_y**2)/self.max_dist
+        return (((1-dist)*self.SCALE_DIST + iou*self.SCALE_IOU)/(self.SCALE_DIST + self.SCALE_IOU)).astype(np.float32)
+
     def step(self, action):
         _state = State()
 
         file   = 'data/' + str(self._sequences[self.current_sequence]) + '/' + \
                  str(self.frames_sequences[self.current_sequence][self.current_frame])
-        frame  = np.asarray(Image.open(file.split('.')[0] + '.png').convert('RGB'), dtype=np.uint8).copy()
 
         # GROUNDTRUTH
         tree   = ET.parse(file.split('.')[0]+'.xml')
@@ -205,7 +238,13 @@ class EnvironmentSeq:
                     'y2': new_y - HEIGHT/2
         }
 
-        if self.current_episode>self.max_guided_eps:
+        if self.all_actions:
+            action_x = self.old_x + self.action_offsets[:, 0]
+            action_y = self.old_y + self.action_offsets[:, 1]
+            self.action_rewards = self.box_rewards(gt_box, action_x, action_y, WIDTH, HEIGHT)
+
+        guided = self.current_episode <= self.max_guided_eps
+        if not guided:
             self.old_x  = new_x # POS_X
             self.old_y  = new_y # POS_Y
         else:
@@ -231,41 +270,43 @@ class EnvironmentSeq:
             "\nDist Reward:", (1-dist)*self.SCALE_DIST, \
             "\nIoU Reward :", iou_constrained*self.SCALE_IOU
 
-        vis_util.draw_bounding_boxes_on_image_array( frame,
-                                                     np.array([[(float(ymin)/float(self.im_height)),
-                                                                (float(xmin)/float(self.im_width)),
-                                                                (float(ymax)/float(self.im_height)),
-                                                                (float(xmax)/float(self.im_width))]]),
-                                                     color='black',
-                                                     thickness=7)
-        vis_util.draw_bounding_boxes_on_image_array( frame,
-                                                     np.array([[(float(self.im_height/2 - det_box['y1'])/float(self.im_height)),
-                                                                (float(det_box['x1'] + self.im_width/2)/float(self.im_width)),
-                                                                (float(self.im_height/2 - det_box['y2'])/float(self.im_height)),
-                                                                (float(det_box['x2'] + self.im_width/2)/float(self.im_width))]]),
-                                                     color='blue',
-                                                     thickness=3)
-        vis_util.draw_bounding_boxes_on_image_array( frame,
-                                                     np.array([[(float(self.im_height/2 - agent_box['y1'])/float(self.im_height)),
-                                                                (float(agent_box['x1'] + self.im_width/2)/float(self.im_width)),
-                                                                (float(self.im_height/2 - agent_box['y2'])/float(self.im_height)),
-                                                                (float(agent_box['x2'] + self.im_width/2)/float(self.im_width))]]),
-                                                     color='yellow',
-                                                     thickness=5)
-        vis_util.draw_bounding_boxes_on_image_array( frame,
-                                                     np.array([[(float(self.im_height/2 - baseline_box['y1'])/float(self.im_height)),
-                                                                (float(baseline_box['x1'] + self.im_width/2)/float(self.im_width)),
-                                                                (float(self.im_height/2 - baseline_box['y2'])/float(self.im_height)),
-                                                                (float(baseline_box['x2'] + self.im_width/2)/float(self.im_width))]]),
-                                                     color='red',
-                                                     thickness=5)
-
-        result = Image.fromarray(frame)
-        path_prefix = 'data/output_train/' + self._sequences[self.current_sequence] + '/'
-        if not os.path.exists(path_prefix):
-            os.makedirs(path_prefix)
-        img_path = path_prefix + self.frames_sequences[self.current_sequence][self.current_frame].split('.')[0] + '.jpg'
-        result.save(img_path)
+        if self.render:
+            frame  = np.asarray(Image.open(file.split('.')[0] + '.png').convert('RGB'), dtype=np.uint8).copy()
+            vis_util.draw_bounding_boxes_on_image_array( frame,
+                                                         np.array([[(float(ymin)/float(self.im_height)),
+                                                                    (float(xmin)/float(self.im_width)),
+                                                                    (float(ymax)/float(self.im_height)),
+                                                                    (float(xmax)/float(self.im_width))]]),
+                                                         color='black',
+                                                         thickness=7)
+            vis_util.draw_bounding_boxes_on_image_array( frame,
+                                                         np.array([[(float(self.im_height/2 - det_box['y1'])/float(self.im_height)),
+                                                                    (float(det_box['x1'] + self.im_width/2)/float(self.im_width)),
+                                                                    (float(self.im_height/2 - det_box['y2'])/float(self.im_height)),
+                                                                    (float(det_box['x2'] + self.im_width/2)/float(self.im_width))]]),
+                                                         color='blue',
+                                                         thickness=3)
+            vis_util.draw_bounding_boxes_on_image_array( frame,
+                                                         np.array([[(float(self.im_height/2 - agent_box['y1'])/float(self.im_height)),
+                                                                    (float(agent_box['x1'] + self.im_width/2)/float(self.im_width)),
+                                                                    (float(self.im_height/2 - agent_box['y2'])/float(self.im_height)),
+                                                                    (float(agent_box['x2'] + self.im_width/2)/float(self.im_width))]]),
+                                                         color='yellow',
+                                                         thickness=5)
+            vis_util.draw_bounding_boxes_on_image_array( frame,
+                                                         np.array([[(float(self.im_height/2 - baseline_box['y1'])/float(self.im_height)),
+                                                                    (float(baseline_box['x1'] + self.im_width/2)/float(self.im_width)),
+                                                                    (float(self.im_height/2 - baseline_box['y2'])/float(self.im_height)),
+                                                                    (float(baseline_box['x2'] + self.im_width/2)/float(self.im_width))]]),
+                                                         color='red',
+                                                         thickness=5)
+
+            result = Image.fromarray(frame)
+            path_prefix = 'data/output_train/' + self._sequences[self.current_sequence] + '/'
+            if not os.path.exists(path_prefix):
+                os.makedirs(path_prefix)
+            img_path = path_prefix + self.frames_sequences[self.current_sequence][self.current_frame].split('.')[0] + '.jpg'
+            result.save(img_path)
 
         done = 0
         self.current_frame += 1
@@ -302,4 +343,14 @@ class EnvironmentSeq:
             _state.DELTA_Y = POS_Y - self.old_y
             self.current_state = _state
 
+        if self.all_actions:
+            if done:
+                self.action_next_states = np.zeros((len(self.action_offsets), 2), dtype='float32')
+            elif guided:
+                # The agent is moved back onto the tracker, the next state does not depend on the action
+                self.action_next_states = np.tile(self.state_to_array(_state), (len(self.action_offsets), 1))
+            else:
+                self.action_next_states = np.stack([(POS_X - action_x)/float(self.im_width),
+                                                    (POS_Y - action_y)/float(self.im_height)], axis=1).astype('float32')
+
         return self.state_to_array(_state), reward, done
@@ -1,19 +1,18 @@
 import os
 import sys
-import cv2
 import time
 import numpy as np
-import matplotlib.pyplot as plt
 
 from PIL import Image
 import xml.etree.ElementTree as ET
 
+from LazyModule import LazyModule
+
 python_path = os.path.abspath('TF_ObjectDetection')
 sys.path.append(python_path)
-from object_detection.utils import visualization_utils as vis_util
+vis_util = LazyModule('object_detection.utils.visualization_utils')
 
-from Detector import Detector
-from MultiRotorConnector import MultiRotorConnector
+from SessionLog import SessionWriter, SessionReader, Recorder, Replayer
 
 class State():
     DELTA_X    = 0.0
@@ -21,7 +20,8 @@ class State():
     pass
 
 class EnvironmentSeqRT:
-    def __init__(self, image_shape=(720, 1280), step_sizes=[-40, -20, 0, 20, 40]):
+    def __init__(self, image_shape=(720, 1280), step_sizes=[-40, -20, 0, 20, 40], record=None, replay=None,
+                 detection_profile=None, recording_profile=None):
         self.ncols = 45
         self.nrows = 45
 
@@ -34,13 +34,50 @@ class EnvironmentSeqRT:
 
         self.current_frame    = None
         self.current_output   = None
-
-        self._detector      = Detector()
-        self._connector     = MultiRotorConnector()
+        self.current_recording = None # Full resolution frame of the recording profile, if any
+
+        # CaptureProfile of the detector input (e.g. a 300x300 camera or a region), detections are mapped back
+        # to image_shape coordinates; recording_profile adds a full resolution frame per tick for recording only
+        self.detection_profile = detection_profile
+
+        # record - log every connector / detector interaction to this session file
+        # replay - run from a recorded session instead of AirSim and the detector, as fast as possible
+        self._session = None
+        if replay is not None:
+            self._session   = SessionReader(replay)
+            self._detector  = Replayer(self._session, 'detector')
+            self._connector = Replayer(self._session, 'drone')
+        else:
+            # TF and AirSim are only imported for live sessions, replay needs neither
+            from Detector import Detector
+            from MultiRotorConnector import MultiRotorConnector
+            self._detector  = Detector()
+            self._connector = MultiRotorConnector(detection_profile=detection_profile,
+                                                  recording_profile=recording_profile)
+            if record is not None:
+                self._session   = SessionWriter(record)
+                self._detector  = Recorder(self._detector, self._session, 'detector', log_args=False)
+                self._connector = Recorder(self._connector, self._session, 'drone')
 
         self.old_x = None
         self.old_y = None
 
+    def close(self):
+        """ Flush and close the recorded / replayed session
+        """
+        if self._session is not None:
+            self._session.close()
+
+    def _detect(self):
+        """ Capture the next detection frame (and recording frame, kept in current_recording) and detect the car.
+        The detection is returned in image_shape pixel coordinates whatever the detection profile.
+        """
+        frame, self.current_recording = self._connector.capture()
+        output = self._detector.detect(frame)
+        if output and self.detection_profile is not None:
+            output = self.detection_profile.to_frame(output, frame.shape, (self.im_height, self.im_width))
+        return frame, output
+
     def state_to_array(self, state):
         out = np.zeros((2,), dtype='float32')
         out[0] = float(state.DELTA_X)/float(self.im_width)
@@ -53,8 +90,7 @@ class EnvironmentSeqRT:
 
     def reset(self):
 
-        frame        = self._connector.get_frame()
-        output       = self._detector.detect(frame)
+        frame, output = self._detect()
         if not output:
             raise Exception('Unable to Detect')
         POS_X1  = output[0]
@@ -63,8 +99,7 @@ class EnvironmentSeqRT:
         HEIGHT1 = output[3]
 
 
-        frame        = self._connector.get_frame()
-        output       = self._detector.detect(frame)
+        frame, output = self._detect()
         if not output:
             raise Exception('Unable to Detect')
         POS_X2  = output[0]
@@ -195,8 +230,7 @@ class EnvironmentSeqRT:
 
         # NEXT frame
         _state = State()
-        frame        = self._connector.get_frame()
-        output       = self._detector.detect(frame)
+        frame, output = self._detect()
         if not output:
             raise Exception('Unable to Detect')
         POS_X  = output[0]
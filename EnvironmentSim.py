@@ -1,18 +1,11 @@
 import os
 import sys
-import cv2
 import time
 import numpy as np
-import matplotlib.pyplot as plt
 
 from PIL import Image
 import xml.etree.ElementTree as ET
 
-python_path = os.path.abspath('TF_ObjectDetection')
-sys.path.append(python_path)
-from object_detection.utils import visualization_utils as vis_util
-
-from Detector import Detector
 from MultiRotorConnector import MultiRotorConnector
 from CarConnector import CarConnector
 
@@ -22,7 +15,8 @@ class State():
     pass
 
 class EnvironmentSim:
-    def __init__(self, image_shape=(720, 1280), max_dist=30.0, max_guided_eps=1000):
+    def __init__(self, image_shape=(720, 1280), max_dist=30.0, max_guided_eps=1000, lockstep=False,
+                 uav_name='', car_name='', uav_pool=None, car_pool=None):
         self.current_episode = 0
         self.max_guided_eps  = max_guided_eps
 
@@ -34,9 +28,9 @@ class EnvironmentSim:
         self.current_frame    = None
         self.current_output   = None
 
-        self._detector      = Detector()
-        self._uav_connector = MultiRotorConnector()
-        self._car_connector = CarConnector()
+        # lockstep - pause the sim between decisions; names / pools - one drone / car pair of a multi-vehicle world
+        self._uav_connector = MultiRotorConnector(lockstep=lockstep, vehicle_name=uav_name, pool=uav_pool)
+        self._car_connector = CarConnector(vehicle_name=car_name, pool=car_pool)
 
     def state_to_array(self, state):
         out = np.zeros((2,), dtype='float32')
@@ -44,14 +38,28 @@ class EnvironmentSim:
         out[1] = float(state.DELTA_Y)/float(self.max_dist)
         return out
 
-    def reset(self):
+    def close(self):
+        self._uav_connector.close()
+        self._car_connector.close()
+
+    def reset_world(self):
+        """ Reset the whole simulator, every vehicle of a multi-vehicle world included
+        """
+        self._car_connector.client.reset()
+
+    def reset(self, world=True):
+        """ world=False resets this pair only, see ParallelEnvironment
+        """
         self.current_episode += 1
 
-        car_pos, car_ort = self._car_connector.reset()
-        self._uav_connector.reset()
-        self._uav_connector.move_by_angle(car_ort, self._uav_connector.INIT_Z)
+        car_pos, car_ort = self._car_connector.reset(world)
+        self._uav_connector.reset(world=False).wait()
+        self._uav_connector.move_by_angle(car_ort, self._uav_connector.INIT_Z).wait()
         self._car_connector.drive()
 
+        # One state call per vehicle for the tick, the next step reads the UAV velocity from it as well
+        self._car_connector.snapshot()
+        self._uav_connector.snapshot(frame=False)
         car_pos = self._car_connector.get_position()
         uav_pos = self._uav_connector.get_position()
 
@@ -79,8 +87,10 @@ class EnvironmentSim:
         print "UAV Vel   :", (uav_vel.x_val, uav_vel.y_val, uav_vel.z_val)
 
         self._car_connector.drive()
-        self._uav_connector.move_by_velocityz(action)
+        self._uav_connector.move_by_velocityz(action).wait()
 
+        self._car_connector.snapshot()
+        self._uav_connector.snapshot(frame=False)
         car_pos = self._car_connector.get_position()
         uav_pos = self._uav_connector.get_position()
         print "Car Pos    :", car_pos.x_val, car_pos.y_val, car_pos.z_val
@@ -0,0 +1,195 @@
+import time
+import random
+import numpy as np
+import multiprocessing as mp
+
+from NumpyPolicy import NumpyPolicy, History
+
+class TransitionBuffer(object):
+    """
+    Single producer / single consumer ring of transitions in shared memory.
+    The worker writes (state, action, reward, done) rows and advances `written`, it also advances `episode_end`
+    whenever an episode terminates. The learner reads up to `episode_end` so that episodes from different
+    workers are never interleaved inside the replay memory.
+    """
+    def __init__(self, capacity, state_shape):
+        self.capacity    = capacity
+        self.state_shape = state_shape
+        state_size       = int(np.prod(state_shape))
+
+        self._states      = mp.RawArray('f', capacity * state_size)
+        self._actions     = mp.RawArray('B', capacity)
+        self._rewards     = mp.RawArray('f', capacity)
+        self._terminals   = mp.RawArray('B', capacity)
+        self.written      = mp.Value('l', 0)
+        self.episode_end  = mp.Value('l', 0)
+        self.read         = mp.Value('l', 0)
+
+    def views(self):
+        """ NumPy views on the shared arrays (must be created in the process using them)
+        """
+        states = np.frombuffer(self._states, dtype=np.float32).reshape((self.capacity,) + self.state_shape)
+        return states, np.frombuffer(self._actions, dtype=np.uint8), \
+               np.frombuffer(self._rewards, dtype=np.float32), np.frombuffer(self._terminals, dtype=np.uint8)
+
+
+def worker_epsilons(num_workers, base=0.4, alpha=7.0):
+    """ Fixed per worker exploration rates eps_i = base^(1 + alpha * i / (N - 1)) (Horgan & al. 2018, Ape-X)
+    """
+    if num_workers == 1:
+        return [base]
+    return [base ** (1.0 + alpha * i / float(num_workers - 1)) for i in range(num_workers)]
+
+
+def run_worker(worker_id, env_factory, interpret_action, buffer, weights, weight_shapes, weight_version,
+               episodes, stop, epsilon, history_length, nb_actions):
+    ''' Worker process main loop - acts with its own epsilon on its own environment instance
+    '''
+    random.seed(worker_id)
+    np.random.seed(worker_id)
+    states, actions, rewards, terminals = buffer.views()
+    shared_weights = np.frombuffer(weights, dtype=np.float32)
+
+    env     = env_factory(worker_id)
+    history = History((history_length,) + buffer.state_shape)
+    policy  = None
+    version = 0
+
+    total_reward, duration = 0.0, 0
+    state = env.reset()
+    while not stop.is_set():
+        # Pick up the latest broadcast weights
+        if weight_version.value != version:
+            with weight_version.get_lock():
+                version = weight_version.value
+                flat    = shared_weights.copy()
+            params, offset = [], 0
+            for shape in weight_shapes:
+                size = int(np.prod(shape))
+                params.append(flat[offset:offset + size].reshape(shape))
+                offset += size
+            if policy is None:
+                policy = NumpyPolicy(params)
+            else:
+                policy.set_weights(params)
+
+        history.append(state)
+        if policy is None or epsilon >= random.random():
+            action = random.randrange(nb_actions)
+        else:
+            action = policy.act(history.value)
+
+        quad_offset, _ = interpret_action(action)
+        new_state, reward, done = env.step(quad_offset)
+
+        # Back-pressure - wait for the learner to consume
+        while buffer.written.value - buffer.read.value >= buffer.capacity and not stop.is_set():
+            time.sleep(0.001)
+
+        index = buffer.written.value % buffer.capacity
+        states[index]    = state
+        actions[index]   = action
+        rewards[index]   = reward
+        terminals[index] = done
+        buffer.written.value += 1
+
+        total_reward += reward
+        duration     += 1
+        if done:
+            buffer.episode_end.value = buffer.written.value
+            episodes.put((worker_id, epsilon, total_reward, duration))
+            total_reward, duration = 0.0, 0
+            history.reset()
+            new_state = env.reset()
+        state = new_state
+
+
+class ExperienceCollector(object):
+    """
+    Runs N worker processes, each owning an environment instance and its own epsilon, which push transitions
+    into the learner's ReplayMemory through shared memory. The learner periodically broadcasts its Q-network
+    weights back to the workers, which act with a NumPy copy of the network.
+
+    Workers are forked, they never touch the learner's TensorFlow session.
+    """
+    CAPACITY = 4096  # Transitions buffered per worker
+
+    def __init__(self, env_factory, interpret_action, num_workers, state_shape, nb_actions, weight_shapes,
+                 history_length=4, epsilons=None, capacity=CAPACITY):
+        self.num_workers   = num_workers
+        self.nb_actions    = nb_actions
+        self.weight_shapes = [tuple(shape) for shape in weight_shapes]
+        self.epsilons      = epsilons if epsilons is not None else worker_epsilons(num_workers)
+
+        self._env_factory      = env_factory
+        self._interpret_action = interpret_action
+        self._history_length   = history_length
+        self._buffers          = [TransitionBuffer(capacity, tuple(state_shape)) for _ in range(num_workers)]
+        self._weights          = mp.RawArray('f', sum(int(np.prod(shape)) for shape in self.weight_shapes))
+        self._weight_version   = mp.Value('l', 0)
+        self._episodes         = mp.Queue()
+        self._stop             = mp.Event()
+        self._workers          = []
+
+    def start(self, weights=None):
+        if weights is not None:
+            self.broadcast(weights)
+        for worker_id in range(self.num_workers):
+            worker = mp.Process(target=run_worker,
+                                args=(worker_id, self._env_factory, self._interpret_action, self._buffers[worker_id],
+                                      self._weights, self.weight_shapes, self._weight_version, self._episodes,
+                                      self._stop, self.epsilons[worker_id], self._history_length, self.nb_actions))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def broadcast(self, weights):
+        """ Publish new Q-network weights to all workers
+        """
+        flat = np.concatenate([np.asarray(w, dtype=np.float32).ravel() for w in weights])
+        with self._weight_version.get_lock():
+            np.frombuffer(self._weights, dtype=np.float32)[:] = flat
+            self._weight_version.value += 1
+
+    def drain(self, memory):
+        """ Move all completed episodes from the worker buffers into the replay memory. An episode longer than
+        a buffer is handed over in pieces, each piece but the last one ends truncated (not terminal, see
+        ReplayMemory). Returns the number of transitions appended.
+        """
+        appended = 0
+        for buffer in self._buffers:
+            states, actions, rewards, terminals = buffer.views()
+            start = buffer.read.value
+            end   = buffer.episode_end.value
+            cut   = False
+            if end <= start and buffer.written.value - start >= buffer.capacity:
+                # The oldest episode alone fills the buffer - hand it over in pieces rather than stall the worker
+                end = buffer.written.value
+                cut = True
+            if end <= start:
+                continue
+
+            indexes   = np.arange(start, end) % buffer.capacity
+            truncated = np.zeros(len(indexes), dtype=np.uint8)
+            truncated[-1] = cut
+            memory.extend(states[indexes], actions[indexes], rewards[indexes], terminals[indexes],
+                          truncated=truncated)
+            buffer.read.value = end
+            appended += end - start
+        return appended
+
+    def episode_stats(self):
+        """ (worker_id, epsilon, total_reward, duration) of every episode finished since the last call
+        """
+        stats = []
+        while not self._episodes.empty():
+            stats.append(self._episodes.get())
+        return stats
+
+    def stop(self):
+        self._stop.set()
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
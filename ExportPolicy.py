@@ -0,0 +1,94 @@
+import os
+import re
+import sys
+import glob
+
+from LazyModule import LazyModule
+from NumpyPolicy import NumpyPolicy
+from CheckpointManager import CheckpointManager
+
+# Full training-state checkpoints are plain NumPy, TF is only needed to read TF checkpoints
+tf = LazyModule('tensorflow')
+
+def layer_index(scope):
+    match = re.search(r'_(\d+)$', scope)
+    return int(match.group(1)) if match else 0
+
+def online_weights(variables):
+    ''' Pick the online Q-network weights in keras get_weights() order out of {variable name: value}
+    '''
+    variables = dict((name.split(':')[0], value) for name, value in variables.items())
+    names     = [name for name in variables.keys()
+                 if name.count('/') == 1 and name.split('/')[-1] in ('kernel', 'recurrent_kernel', 'bias')]
+
+    # The online network is built first, so it owns the lowest numbered lstm_* and dense_* scopes
+    lstm_scopes  = sorted(set(name.split('/')[0] for name in names if name.startswith('lstm')), key=layer_index)
+    dense_scopes = sorted(set(name.split('/')[0] for name in names if name.startswith('dense')), key=layer_index)
+    if not lstm_scopes:
+        raise Exception('No LSTM weights found')
+    dense_scopes = dense_scopes[:len(dense_scopes) // len(lstm_scopes)]
+
+    weights = [variables[lstm_scopes[0] + '/' + name] for name in ('kernel', 'recurrent_kernel', 'bias')]
+    for scope in dense_scopes:
+        weights += [variables[scope + '/kernel'], variables[scope + '/bias']]
+    return weights
+
+def checkpoint_weights(checkpoint_path):
+    ''' Read the online Q-network weights from a TF checkpoint
+    '''
+    reader = tf.train.NewCheckpointReader(checkpoint_path)
+    return online_weights(dict((name, reader.get_tensor(name)) for name in reader.get_variable_to_shape_map().keys()))
+
+def latest_checkpoint(checkpoint_dir):
+    ''' Path of the newest checkpoint in checkpoint_dir, full training state first, None if there is none.
+    Read only, TF is only imported when the directory holds TF checkpoints (a `checkpoint` index file).
+    '''
+    latest = CheckpointManager(checkpoint_dir).latest()
+    if latest is not None:
+        return latest
+    if not os.path.isfile(os.path.join(checkpoint_dir, 'checkpoint')):
+        return None
+    checkpoint = tf.train.get_checkpoint_state(checkpoint_dir)
+    if checkpoint and checkpoint.model_checkpoint_path:
+        return checkpoint.model_checkpoint_path
+    return None
+
+def load_weights(source):
+    ''' Online Q-network weights of a checkpoint returned by latest_checkpoint()
+    '''
+    if os.path.isdir(source):
+        return online_weights(CheckpointManager(os.path.dirname(source)).load_variables(source))
+    return checkpoint_weights(source)
+
+def export_checkpoint(checkpoint_dir, path):
+    ''' Dump the latest checkpoint in checkpoint_dir (full training state or TF checkpoint) to a NumpyPolicy .npz
+    '''
+    source = latest_checkpoint(checkpoint_dir)
+    if source is None:
+        raise Exception('No checkpoint found in ' + checkpoint_dir)
+
+    policy = NumpyPolicy(load_weights(source))
+    policy.save(path)
+    print "Exported:", source, "->", path
+    return policy
+
+def checkpoint_mtime(source):
+    ''' Modification time of a checkpoint returned by latest_checkpoint()
+    '''
+    if os.path.isdir(source):
+        return os.path.getmtime(source)
+    return max(os.path.getmtime(path) for path in glob.glob(source + '*')) # TF checkpoint prefix
+
+def export_if_stale(checkpoint_dir, path):
+    ''' Export the latest checkpoint to `path` unless the .npz there is at least as recent, so a deployment never
+    silently loads the policy of an older training run
+    '''
+    source = latest_checkpoint(checkpoint_dir)
+    if not os.path.isfile(path) or (source is not None and checkpoint_mtime(source) > os.path.getmtime(path)):
+        export_checkpoint(checkpoint_dir, path)
+
+
+if __name__=='__main__':
+    checkpoint_dir = sys.argv[1] if len(sys.argv) > 1 else 'models'
+    path           = sys.argv[2] if len(sys.argv) > 2 else os.path.join(checkpoint_dir, 'policy.npz')
+    export_checkpoint(checkpoint_dir, path)
@@ -0,0 +1,27 @@
+import importlib
+
+class LazyModule(object):
+    """
+    Stand-in for a module which is only imported on first attribute access, so heavy optional
+    dependencies (TensorFlow, the object_detection drawing utilities, ...) are only paid for by
+    the runs that actually use them.
+        tf = LazyModule('tensorflow')
+    """
+    def __init__(self, name):
+        self.__dict__['_name']   = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
@@ -1,13 +1,59 @@
 import os
 import sys
 import time
+import threading
 import numpy as np
-from PIL import Image
 
 python_path = os.path.abspath('AirSim/PythonClient')
 sys.path.append(python_path)
 from AirSimClient import *
 
+from ConnectionPool import VehicleClient
+from CaptureProfile import CaptureProfile, rgba_to_rgb
+
+class Snapshot(object):
+    """
+    Vehicle state of one simulator tick
+    """
+    def __init__(self, position=None, velocity=None, orientation=None, collision_info=None, frame=None):
+        self.position       = position
+        self.velocity       = velocity
+        self.orientation    = orientation # Quaternion
+        self.collision_info = collision_info
+        self.frame          = frame
+        self.time           = time.time()
+
+class MotionFuture(object):
+    """
+    Completion of a motion command that has already been sent. done() checks the completion condition
+    (position reached, velocity settled, control period elapsed, ...) and wait() polls it until it holds
+    or `timeout` seconds passed. `reached` tells both apart.
+    `step`, when given, is called between two checks instead of sleeping, e.g. to advance a paused simulator.
+    """
+    def __init__(self, condition, timeout, poll_interval=0.02, clock=time.time, step=None):
+        self._condition    = condition
+        self.timeout       = timeout
+        self.poll_interval = poll_interval
+        self._clock        = clock
+        self._step         = step
+        self._start        = clock()
+        self._done         = False
+        self.reached       = False
+
+    def done(self):
+        if not self._done:
+            self.reached = bool(self._condition())
+            self._done   = self.reached or self._clock() - self._start >= self.timeout
+        return self._done
+
+    def wait(self):
+        while not self.done():
+            if self._step is not None:
+                self._step()
+            else:
+                time.sleep(self.poll_interval)
+        return self.reached
+
 class MultiRotorConnector:
     client = None
 
@@ -15,68 +61,241 @@ class MultiRotorConnector:
     INIT_Y = -0
     INIT_Z = -15
 
-    def __init__(self):
-        self.client = MultirotorClient()
-        self.client.confirmConnection()
+    POSITION_TOLERANCE = 0.5  # Meters from the target position for move_to_position to complete
+    VELOCITY_TOLERANCE = 0.25 # m/s from the commanded velocity for the velocity commands to complete
+    CONTROL_PERIOD     = 0.1  # Seconds after which move_by_angle completes
+    SETTLE_TIMEOUT     = 0.5  # Upper bound for the velocity commands, the former fixed sleep
+    MOVE_TIMEOUT       = 30.0 # Upper bound for move_to_position
+
+    def __init__(self, frame_size=None, lockstep=False, vehicle_name='', pool=None, detection_profile=None,
+                 recording_profile=None):
+        self.frame_size = frame_size # (width, height) frames are resized to, None keeps the camera resolution
+
+        # CaptureProfile of the frames capture() hands to the detector, and of the optional full resolution
+        # frames fetched with them for recording only
+        self.detection_profile = detection_profile or CaptureProfile(size=frame_size)
+        self.recording_profile = recording_profile
+
+        # vehicle_name - drone of a multi-vehicle simulator, '' is the default vehicle
+        # pool         - ConnectionPool of MultirotorClient connections to lease from instead of opening new ones
+        self.vehicle_name = vehicle_name
+        self.pool         = pool
+        self.client       = VehicleClient(self._connect(), vehicle_name)
         self.client.enableApiControl(True)
+
+        # Lockstep - the simulator stays paused between agent decisions and every motion command advances it
+        # by exactly CONTROL_PERIOD seconds of simulated time, so training runs as fast as the sim can compute.
+        # Motion futures are then timed by sim_time instead of the wall clock.
+        self.lockstep = lockstep
+        self.sim_time = 0.0
+        if self.lockstep:
+            self._sim_call('simPause', True)
+
+        self.current_snapshot = None # Cached by snapshot() until the next motion command
+        self._image_client    = None # Second connection, images are fetched while the state call is in flight
         # self.client.armDisarm(True)
         # self.client.takeoff()
         # self.client.moveToPosition(self.INIT_X, self.INIT_Y, self.INIT_Z, 10)
 
-    def reset(self):
-        self.client.reset()
+    def _connect(self):
+        if self.pool is not None:
+            return self.pool.acquire()
+        client = MultirotorClient()
+        client.confirmConnection()
+        return client
+
+    def close(self):
+        """ Hand the connections back to the pool
+        """
+        if self.pool is not None:
+            for client in (self.client, self._image_client):
+                if client is not None:
+                    self.pool.release(client._client)
+        self.client = self._image_client = None
+
+    def reset(self, world=True):
+        """ world=False keeps the rest of the simulator as it is (other vehicles of a multi-vehicle world) and only
+        flies this drone back to its start
+        """
+        self.current_snapshot = None
+        if self.lockstep:
+            self._sim_call('simPause', False) # takeoff blocks until airborne
+        if world:
+            self.client.reset()
         self.client.enableApiControl(True)
         self.client.armDisarm(True)
         self.client.takeoff()
+        if self.lockstep:
+            self._sim_call('simPause', True)
         self.client.moveToPosition(self.INIT_X, self.INIT_Y, self.INIT_Z, 10)
-        time.sleep(2)
+        return self._future(self._position_reached((self.INIT_X, self.INIT_Y, self.INIT_Z)), self.MOVE_TIMEOUT)
+
+    def _sim_call(self, name, *args):
+        """ Simulator API call, over the raw RPC connection on clients that do not wrap it yet
+        """
+        if hasattr(self.client, name):
+            return getattr(self.client, name)(*args)
+        return self.client.client.call(name, *args)
+
+    def clock(self):
+        """ Time base of the motion futures: simulated time in lockstep, the wall clock otherwise
+        """
+        if self.lockstep:
+            return self.sim_time
+        return time.time()
+
+    def advance(self, period=None):
+        """ Let `period` (default CONTROL_PERIOD) seconds of simulation pass in lockstep: the paused simulator
+        runs for exactly that time and pauses again. Nothing to do in real time, the simulator runs on its own.
+        """
+        if not self.lockstep:
+            return
+        period = self.CONTROL_PERIOD if period is None else period
+        self.current_snapshot = None
+        self._sim_call('simContinueForTime', period)
+        while not self._sim_call('simIsPaused'):
+            time.sleep(0.001)
+        self.sim_time += period
+
+    def _future(self, condition, timeout):
+        if self.lockstep:
+            return MotionFuture(condition, timeout, clock=self.clock, step=self.advance)
+        return MotionFuture(condition, timeout, clock=self.clock)
+
+    def _position_reached(self, target):
+        def condition():
+            position = self.client.getPosition()
+            return np.linalg.norm([position.x_val - target[0], position.y_val - target[1],
+                                   position.z_val - target[2]]) <= self.POSITION_TOLERANCE
+        return condition
+
+    def _velocity_settled(self, target):
+        def condition():
+            velocity = self.client.getVelocity()
+            return all(abs(value - wanted) <= self.VELOCITY_TOLERANCE
+                       for value, wanted in zip((velocity.x_val, velocity.y_val, velocity.z_val), target)
+                       if wanted is not None)
+        return condition
+
+    def _settled(self, target):
+        """ Completion of the velocity commands: settled in real time, one control period in lockstep
+        """
+        if self.lockstep:
+            return self._future(self._period_elapsed(self.CONTROL_PERIOD), self.CONTROL_PERIOD)
+        return self._future(self._velocity_settled(target), self.SETTLE_TIMEOUT)
+
+    def _period_elapsed(self, period):
+        end = self.clock() + period
+        return lambda: self.clock() >= end
 
     # The camera ID 0 to 4 corresponds to center front, left front, right front, center downward, center rear respectively.
-    def get_frame(self, camera_id=3, path='frame.png'):
+    # Returns an RGB frame, see rgba_to_rgb. `out` reuses a preallocated buffer, `path` also saves the frame.
+    def get_frame(self, camera_id=3, path=None, size=None, out=None):
         response = self.client.simGetImages([ImageRequest(camera_id, AirSimImageType.Scene, False, False)])[0]
-        img1d = np.fromstring(response.image_data_uint8, dtype=np.uint8) # get numpy array
-        img_rgba = img1d.reshape(response.height, response.width, 4) # reshape array to 4 channel image array H X W X 4
-        img_rgba = np.flipud(img_rgba) # original image is fliped vertically
-        return img_rgba
-
-        # TODO - Implement conversion of uncmpressed RGBA to RGB without writing to disk
-        self.client.write_png(os.path.normpath(path), img_rgba)
-        img_rgb = np.asarray(Image.open(path).convert('RGB'), dtype=np.uint8)
+        img_rgb  = rgba_to_rgb(response.image_data_uint8, response.height, response.width,
+                               size or self.frame_size, out)
+        if path is not None:
+            from PIL import Image
+            Image.fromarray(img_rgb).save(os.path.normpath(path))
         return img_rgb
 
 
+    def capture(self):
+        """ Detection frame and recording frame (None without a recording profile) of the same tick, one
+        simGetImages call for both
+        """
+        profiles = [self.detection_profile] + ([self.recording_profile] if self.recording_profile else [])
+        frames   = self.capture_views(profiles)
+        return frames[0], (frames[1] if self.recording_profile else None)
+
+    def capture_views(self, profiles):
+        """ One frame per CaptureProfile (e.g. several cameras), all from a single simGetImages call
+        """
+        responses = self.client.simGetImages([profile.request() for profile in profiles])
+        return [profile.convert(response) for profile, response in zip(profiles, responses)]
+
+    def snapshot(self, camera_id=3, frame=True, size=None):
+        """ Fetch everything an environment tick needs: position, velocity, orientation and collision info in one
+        getMultirotorState call (separate calls on clients without it), and the camera frame over a second
+        connection at the same time. The result is cached in current_snapshot and served by the get_* methods
+        until the next motion command.
+        """
+        fetched = {}
+        fetcher = None
+        if frame:
+            if self._image_client is None:
+                self._image_client = VehicleClient(self._connect(), self.vehicle_name)
+            def fetch_frame():
+                response = self._image_client.simGetImages([ImageRequest(camera_id, AirSimImageType.Scene, False, False)])[0]
+                fetched['frame'] = rgba_to_rgb(response.image_data_uint8, response.height, response.width,
+                                               size or self.frame_size)
+            fetcher = threading.Thread(target=fetch_frame)
+            fetcher.start()
+
+        if hasattr(self.client, 'getMultirotorState'):
+            state       = self.client.getMultirotorState()
+            kinematics  = getattr(state, 'kinematics_true', None) or state.kinematics_estimated
+            snapshot    = Snapshot(kinematics.position, kinematics.linear_velocity, kinematics.orientation, state.collision)
+        else:
+            snapshot    = Snapshot(self.client.getPosition(), self.client.getVelocity(), self.client.getOrientation(),
+                                   self.client.getCollisionInfo())
+
+        if fetcher is not None:
+            fetcher.join()
+            if 'frame' not in fetched:
+                raise Exception('Unable to fetch the camera frame')
+            snapshot.frame = fetched['frame']
+
+        self.current_snapshot = snapshot
+        return snapshot
+
     def get_velocity(self):
+        if self.current_snapshot is not None:
+            return self.current_snapshot.velocity
         return self.client.getVelocity()
 
     def get_position(self):
+        if self.current_snapshot is not None:
+            return self.current_snapshot.position
         return self.client.getPosition()
 
     def get_orientation(self):
+        if self.current_snapshot is not None:
+            return self.client.toEulerianAngle(self.current_snapshot.orientation)
         return self.client.getPitchRollYaw()
 
     def get_collision_info(self):
+        if self.current_snapshot is not None:
+            return self.current_snapshot.collision_info
         return self.client.getCollisionInfo()
 
+    # Motion commands return a MotionFuture right after sending the command, wait() on it blocks until completion.
     def move_by_velocity(self, offset, duration=5):
-        quad_vel = self.client.getVelocity()
-        self.client.moveByVelocity( quad_vel.x_val + offset[0],
-                                    quad_vel.y_val + offset[1],
-                                    quad_vel.z_val + offset[2],
+        quad_vel = self.get_velocity()
+        self.current_snapshot = None
+        target = (quad_vel.x_val + offset[0], quad_vel.y_val + offset[1], quad_vel.z_val + offset[2])
+        self.client.moveByVelocity( target[0],
+                                    target[1],
+                                    target[2],
                                     duration)
-        time.sleep(0.5)
+        return self._settled(target)
 
     def move_by_velocityz(self, offset, duration=5):
-        quad_vel = self.client.getVelocity()
-        self.client.moveByVelocityZ( quad_vel.x_val + offset[0],
-                                     quad_vel.y_val + offset[1],
+        quad_vel = self.get_velocity()
+        self.current_snapshot = None
+        target = (quad_vel.x_val + offset[0], quad_vel.y_val + offset[1], None) # z is held at INIT_Z
+        self.client.moveByVelocityZ( target[0],
+                                     target[1],
                                      self.INIT_Z,
                                      duration)
-        time.sleep(0.5)
+        return self._settled(target)
 
     def move_to_position(self, offset, speed=5, drivetrain=DrivetrainType.ForwardOnly):
+        self.current_snapshot = None
         self.client.moveToPosition(offset[0], offset[1], offset[2], speed)
-        time.sleep(0.5)
+        return self._future(self._position_reached(offset), self.MOVE_TIMEOUT)
 
     def move_by_angle(self, offset, z, duration=5):
+        self.current_snapshot = None
         self.client.moveByAngle(offset[0], offset[1], z, offset[2], duration)
-        time.sleep(0.5)
+        return self._future(self._period_elapsed(self.CONTROL_PERIOD), self.CONTROL_PERIOD)
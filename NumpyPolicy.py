@@ -0,0 +1,175 @@
+import numpy as np
+
+class History(object):
+    """
+    Accumulator keeping track of the N previous frames to be used by the agent (and DeepQAgent).
+    Ring buffer of twice the history length where every frame is written twice, so the N most recent
+    frames are always a contiguous view and nothing is shifted on append
+    """
+    def __init__(self, shape):
+        self._length = shape[0]
+        self._pos    = 0
+        self._buffer = np.zeros((2 * shape[0],) + tuple(shape[1:]), dtype=np.float32)
+
+    @property
+    def value(self):
+        return self._buffer[self._pos:self._pos + self._length]
+
+    def append(self, state):
+        self._buffer[self._pos]                = state
+        self._buffer[self._pos + self._length] = state
+        self._pos = (self._pos + 1) % self._length
+
+    def reset(self):
+        self._buffer.fill(0)
+        self._pos = 0
+
+
+def hard_sigmoid(x):
+    return np.clip(0.2 * x + 0.5, 0.0, 1.0)
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+class NumpyPolicy(object):
+    """
+    Forward pass of the DeepQAgent network LSTM(16) + Dense(32) + Dense(32) + Dense(nb_actions) in plain NumPy.
+    Weights are taken in the order returned by keras Model.get_weights() (or sess.run on the trainable weights):
+        [lstm_kernel, lstm_recurrent_kernel, lstm_bias, w1, b1, w2, b2, w3, b3]
+    LSTM gates are ordered (i, f, c, o) and the recurrent activation defaults to keras' hard_sigmoid.
+
+    In streaming mode test() carries the LSTM hidden and cell state forward and only processes the new
+    observation. Every `resync_interval` steps the state is rebuilt from the last STATE_LENGTH observations
+    starting from zero, which is exactly the windowed formulation the network was trained with; the steps in
+    between see a longer history than in training and may act differently, hence streaming is opt-in.
+    resync_interval=None never resyncs and lets the effective history grow without bound.
+    """
+    STATE_LENGTH = 4
+
+    def __init__(self, weights, recurrent_activation='hard_sigmoid', history_length=STATE_LENGTH,
+                 streaming=False, resync_interval=STATE_LENGTH):
+        self.recurrent_activation = hard_sigmoid if recurrent_activation=='hard_sigmoid' else sigmoid
+        self.activation_name      = recurrent_activation
+        self.set_weights(weights)
+
+        self.t        = 0
+        self._history = History((history_length, self.kernel.shape[0]))
+
+        self.streaming       = streaming
+        self.resync_interval = resync_interval
+        self.reset_state()
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """ Load a policy written by save() or ExportPolicy.py
+        """
+        with np.load(path) as data:
+            weights = [data['w%d' % i] for i in range(int(data['num_weights']))]
+            kwargs.setdefault('recurrent_activation', str(data['recurrent_activation']))
+        return cls(weights, **kwargs)
+
+    def save(self, path):
+        arrays = dict(('w%d' % i, w) for i, w in enumerate(self.get_weights()))
+        np.savez(path, num_weights=len(arrays), recurrent_activation=self.activation_name, **arrays)
+
+    def get_weights(self):
+        weights = [self.kernel, self.recurrent_kernel, self.bias]
+        for w, b in self.dense:
+            weights += [w, b]
+        return weights
+
+    def set_weights(self, weights):
+        """ Replace the network parameters, weights as listed in the class docstring
+        """
+        weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        self.kernel, self.recurrent_kernel, self.bias = weights[0:3]
+        self.dense = [(weights[i], weights[i + 1]) for i in range(3, len(weights), 2)]
+        self.units = self.recurrent_kernel.shape[0]
+
+        # A carried state computed with the old weights is meaningless, rebuild it on the next step
+        self._resync = True
+
+    def reset_state(self):
+        """ Clear the carried streaming state and the history
+        """
+        self.t       = 0
+        self._h      = np.zeros((self.units,), dtype=np.float32)
+        self._c      = np.zeros((self.units,), dtype=np.float32)
+        self._resync = True
+        self._history.reset()
+
+    def lstm_step(self, x_proj, h, c):
+        """ One LSTM step given the already projected input x.W + b
+        """
+        u = self.units
+        z = x_proj + np.dot(h, self.recurrent_kernel)
+        i = self.recurrent_activation(z[..., :u])
+        f = self.recurrent_activation(z[..., u:2 * u])
+        c = f * c + i * np.tanh(z[..., 2 * u:3 * u])
+        o = self.recurrent_activation(z[..., 3 * u:])
+        h = o * np.tanh(c)
+        return h, c
+
+    def head(self, h):
+        """ Dense layers on top of the LSTM output
+        """
+        out = h
+        for k, (w, b) in enumerate(self.dense):
+            out = np.dot(out, w) + b
+            if k < len(self.dense) - 1:
+                out = np.maximum(out, 0.0)
+        return out
+
+    def q_values(self, history):
+        """ Q-values for a history of shape (T, input_dims) or a batch of histories (B, T, input_dims)
+        """
+        history = np.asarray(history, dtype=np.float32)
+        x_proj  = np.dot(history, self.kernel) + self.bias
+        h = np.zeros(history.shape[:-2] + (self.units,), dtype=np.float32)
+        c = np.zeros_like(h)
+        for t in range(history.shape[-2]):
+            h, c = self.lstm_step(x_proj[..., t, :], h, c)
+        return self.head(h)
+
+    def act(self, history):
+        return int(np.argmax(self.q_values(history)))
+
+    def stream(self, state):
+        """ Advance the carried LSTM state by one observation and return the Q-values
+        """
+        self._history.append(state)
+        self.t += 1
+
+        if self._resync or (self.resync_interval and self.t % self.resync_interval == 0):
+            # Rebuild the state from the window, starting from zero as in training
+            history = self._history.value if self.t >= self._history._length \
+                      else self._history.value[-self.t:]
+            x_proj  = np.dot(history, self.kernel) + self.bias
+            h = np.zeros((self.units,), dtype=np.float32)
+            c = np.zeros_like(h)
+            for t in range(x_proj.shape[0]):
+                h, c = self.lstm_step(x_proj[t], h, c)
+            self._resync = False
+        else:
+            x_proj = np.dot(np.asarray(state, dtype=np.float32), self.kernel) + self.bias
+            h, c   = self.lstm_step(x_proj, self._h, self._c)
+
+        self._h, self._c = h, c
+        return self.head(h)
+
+    def test(self, state):
+        """ Drop-in for DeepQAgent.test - append the state to the history and return the greedy action
+        once the history is full (None before that)
+        """
+        if self.streaming:
+            q_values = self.stream(state)
+            if self.t >= self._history._length:
+                return int(np.argmax(q_values))
+            return None
+
+        self.t += 1
+        self._history.append(state)
+
+        if self.t >= self._history._length:
+            return self.act(self._history.value)
+        return None
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from multiprocessing.pool import ThreadPool
+
+from EnvironmentSim import EnvironmentSim
+from ConnectionPool import ConnectionPool
+from AirSimClient import MultirotorClient, CarClient
+
+class ParallelEnvironment(object):
+    """
+    K EnvironmentSim drone / car pairs in one simulator, stepped concurrently: every pair runs its step on its own
+    thread over its own pooled connections, so the RPCs of the K rollouts overlap instead of queuing.
+    Episodes are synchronized, a finished pair idles until all pairs are done and the world is reset once.
+    """
+    def __init__(self, vehicle_pairs, **env_kwargs):
+        if env_kwargs.get('lockstep') and len(vehicle_pairs) > 1:
+            raise Exception('Lockstep advances the simulator per drone, use one pair or real time')
+
+        self.vehicle_pairs = vehicle_pairs
+        self.uav_pool      = ConnectionPool(MultirotorClient, len(vehicle_pairs))
+        self.car_pool      = ConnectionPool(CarClient, len(vehicle_pairs))
+        self.envs          = [EnvironmentSim(uav_name=uav_name, car_name=car_name, uav_pool=self.uav_pool,
+                                             car_pool=self.car_pool, **env_kwargs)
+                              for uav_name, car_name in vehicle_pairs]
+        self.dones         = np.ones(len(self.envs), dtype=bool)
+        self._threads      = ThreadPool(len(self.envs))
+
+    def __len__(self):
+        return len(self.envs)
+
+    def reset(self):
+        """ Reset the world and every pair, returns the (K, 2) initial states
+        """
+        self.envs[0].reset_world()
+        states     = self._threads.map(lambda env: env.reset(world=False), self.envs)
+        self.dones = np.zeros(len(self.envs), dtype=bool)
+        return np.array(states)
+
+    def step(self, actions):
+        """ One action per pair, returns the (K, 2) states, the rewards and the dones.
+        Pairs already done are not stepped, they report a zero state, no reward and done.
+        """
+        def step_pair(i):
+            if self.dones[i]:
+                return np.zeros((2,), dtype='float32'), 0.0, 1
+            return self.envs[i].step(actions[i])
+
+        results = self._threads.map(step_pair, range(len(self.envs)))
+        states, rewards, dones = zip(*results)
+        self.dones = np.array(dones, dtype=bool)
+        return np.array(states), np.array(rewards, dtype=np.float32), self.dones.copy()
+
+    def all_done(self):
+        return bool(self.dones.all())
+
+    def close(self):
+        self._threads.close()
+        self._threads.join()
+        for env in self.envs:
+            env.close()
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Random rollouts of drone / car pairs in parallel, reports the step rate')
+    parser.add_argument('--pairs', nargs='+', default=['Drone1:Car1', 'Drone2:Car2'],
+                        help='DRONE:CAR vehicle names as in the AirSim settings.json')
+    parser.add_argument('--steps', type=int, default=1000, help='Steps of all pairs together')
+    parser.add_argument('--max-speed', type=float, default=1.0, help='Largest random velocity offset (m/s)')
+    args = parser.parse_args()
+
+    env = ParallelEnvironment([pair.split(':') for pair in args.pairs])
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w') # Per step parameters of every pair
+    try:
+        steps, start = 0, time.time()
+        env.reset()
+        while steps < args.steps:
+            actions = np.random.uniform(-args.max_speed, args.max_speed, (len(env), 2))
+            steps  += int((~env.dones).sum()) # Pairs actually stepped
+            env.step(actions)
+            if env.all_done():
+                env.reset()
+        elapsed = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        env.close()
+    print "%d pairs: %d steps in %.1f s, %.1f steps/s" % (len(env), steps, elapsed, steps / elapsed)
@@ -0,0 +1,164 @@
+import os
+import time
+import argparse
+import threading
+import numpy as np
+from six.moves import queue
+from multiprocessing.connection import Listener, Client
+
+from NumpyPolicy import NumpyPolicy, History
+
+class PolicyServer(object):
+    """
+    Serves the greedy actions of a single NumpyPolicy to many environment processes over a Unix socket.
+    Every client sends its history window (STATE_LENGTH, input_dims) and blocks until the action comes back.
+    Requests queued within `max_delay` seconds of the first waiting one are evaluated as one batch of at most
+    `max_batch` histories, so a decision never waits longer than max_delay plus one batched forward pass,
+    while many concurrent environments share the same matmuls.
+    With a CheckpointWatcher set as `watcher`, newer checkpoints are swapped in between two batches.
+    """
+    def __init__(self, policy, address, max_batch=64, max_delay=0.002):
+        self.policy    = policy
+        self.address   = address
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+
+        self.requests = 0
+        self.batches  = 0
+
+        if os.path.exists(address):
+            os.remove(address)
+        self._listener = Listener(address, family='AF_UNIX')
+        self._queue    = queue.Queue()
+        self._stop     = threading.Event()
+        self._lock     = threading.Lock()
+        self._batcher  = None
+        self.watcher   = None
+
+    def serve_forever(self):
+        """ Accept clients on this thread, one reader thread per client, the batches are run by a worker thread
+        """
+        self._batcher = threading.Thread(target=self._run_batches)
+        self._batcher.daemon = True
+        self._batcher.start()
+        print "Serving:", self.address
+
+        while not self._stop.is_set():
+            try:
+                connection = self._listener.accept()
+            except Exception:
+                if self._stop.is_set():
+                    break
+                raise
+            reader = threading.Thread(target=self._read, args=(connection,))
+            reader.daemon = True
+            reader.start()
+
+    def _read(self, connection):
+        try:
+            while True:
+                self._queue.put((connection, connection.recv()))
+        except (EOFError, IOError):
+            connection.close()
+
+    def _run_batches(self):
+        while not self._stop.is_set():
+            try:
+                batch = [self._queue.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+
+            deadline = time.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.time())))
+                except queue.Empty:
+                    break
+
+            weights = self.watcher.poll() if self.watcher is not None else None
+            with self._lock:
+                if weights is not None:
+                    self.policy.set_weights(weights)
+                q_values = self.policy.q_values(np.stack([history for _, history in batch]))
+            for (connection, _), action in zip(batch, np.argmax(q_values, axis=1)):
+                try:
+                    connection.send(int(action))
+                except IOError:
+                    pass # Client went away, its reader thread closes the connection
+
+            self.requests += len(batch)
+            self.batches  += 1
+
+    def set_weights(self, weights):
+        """ Swap the served weights between two batches
+        """
+        with self._lock:
+            self.policy.set_weights(weights)
+
+    def close(self):
+        self._stop.set()
+        self._listener.close()
+        if self._batcher is not None:
+            self._batcher.join()
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        if self.batches:
+            print "Requests:", self.requests, "Batches:", self.batches, \
+                "Mean batch size:", float(self.requests) / self.batches
+
+
+class PolicyClient(object):
+    """
+    Drop-in for DeepQAgent.test / NumpyPolicy.test in an environment process, the history is kept here and
+    the forward pass is done by a PolicyServer
+    """
+    def __init__(self, address, history_shape=(NumpyPolicy.STATE_LENGTH, 2)):
+        self._connection = Client(address, family='AF_UNIX')
+        self._history    = History(history_shape)
+        self.t           = 0
+
+    def act(self, history):
+        self._connection.send(np.asarray(history, dtype=np.float32))
+        return self._connection.recv()
+
+    def reset_state(self):
+        self.t = 0
+        self._history.reset()
+
+    def test(self, state):
+        self.t += 1
+        self._history.append(state)
+
+        if self.t >= self._history._length:
+            return self.act(self._history.value)
+        return None
+
+    def close(self):
+        self._connection.close()
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Batched policy server for many concurrent environments')
+    parser.add_argument('--models', default='models', help='Checkpoint directory')
+    parser.add_argument('--address', default='/tmp/dqn_policy.sock', help='Unix socket path')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-delay', type=float, default=0.002, help='Seconds a request waits for others to batch with')
+    parser.add_argument('--reload-interval', type=float, default=None,
+                        help='Poll the checkpoint directory every N seconds and serve newer checkpoints')
+    args = parser.parse_args()
+
+    policy_path = os.path.join(args.models, 'policy.npz')
+    from ExportPolicy import export_if_stale
+    export_if_stale(args.models, policy_path)
+
+    server = PolicyServer(NumpyPolicy.load(policy_path), args.address, args.max_batch, args.max_delay)
+    if args.reload_interval:
+        from CheckpointWatcher import CheckpointWatcher
+        watcher = CheckpointWatcher(args.models, interval=args.reload_interval)
+        server.watcher = watcher
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
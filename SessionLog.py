@@ -0,0 +1,207 @@
+import os
+import time
+import atexit
+import zlib
+import struct
+import numpy as np
+from collections import deque
+from six.moves import cPickle as pickle
+
+MAGIC  = b'RTLOG1\n'
+OBJECT = '__object__' # Key holding the class name of a logged object
+
+class Fields(object):
+    """
+    Replayed object (AirSim Vector3r, kinematics, collision info, Snapshot, ...), its fields as attributes
+    """
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+
+    def __repr__(self):
+        return 'Fields(%r)' % self.__dict__
+
+def to_plain(value):
+    ''' Logged form of a value: objects become dicts of their fields tagged with their class name, so that
+    loading a log never imports the classes (AirSimClient and msgpack-rpc are not needed to replay)
+    '''
+    if isinstance(value, dict):
+        return dict((key, to_plain(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [to_plain(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(to_plain(item) for item in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, '__dict__') and not isinstance(value, np.ndarray):
+        plain = to_plain(vars(value))
+        plain[OBJECT] = value.__class__.__name__
+        return plain
+    return value
+
+def from_plain(value):
+    ''' Replayed value of a logged one, objects come back as Fields
+    '''
+    if isinstance(value, dict):
+        fields = dict((key, from_plain(item)) for key, item in value.items() if key != OBJECT)
+        return Fields(fields) if OBJECT in value else fields
+    if isinstance(value, list):
+        return [from_plain(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(from_plain(item) for item in value)
+    return value
+
+class SessionWriter(object):
+    """
+    Append-only session log. Records are buffered and written `chunk_size` at a time as one zlib-compressed
+    pickle, prefixed by its byte length, so a crash loses at most the last unfinished chunk. Whatever is
+    buffered is also written at interpreter exit (end of the training loop by Ctrl-C, exceptions).
+    """
+    def __init__(self, path, chunk_size=64, level=1):
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        new          = not os.path.isfile(path) or os.path.getsize(path) == 0
+        self._file   = open(path, 'ab')
+        self._chunk  = []
+        self.chunk_size = chunk_size
+        self.level      = level
+        if new:
+            self._file.write(MAGIC)
+        atexit.register(self.flush)
+
+    def append(self, record):
+        self._chunk.append(record)
+        if len(self._chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._chunk and not self._file.closed:
+            payload = zlib.compress(pickle.dumps(self._chunk, protocol=2), self.level)
+            self._file.write(struct.pack('<I', len(payload)) + payload)
+            self._file.flush()
+            self._chunk = []
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+class SessionReader(object):
+    """
+    Reads a session log chunk by chunk, records are handed out per channel in the order they were written
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise Exception('Not a session log: ' + path)
+        self._queues = {}
+
+    def _read_chunk(self):
+        """ Records of the next chunk, None at the end of the log
+        """
+        header = self._file.read(4)
+        if len(header) < 4:
+            return None
+        length  = struct.unpack('<I', header)[0]
+        payload = self._file.read(length)
+        if len(payload) < length:
+            return None # Truncated last chunk of an interrupted recording
+        return pickle.loads(zlib.decompress(payload))
+
+    def peek(self, channel):
+        """ Next record of the channel, None at the end of the log
+        """
+        queue = self._queues.setdefault(channel, deque())
+        while not queue:
+            chunk = self._read_chunk()
+            if chunk is None:
+                return None
+            for record in chunk:
+                self._queues.setdefault(record[0], deque()).append(record)
+        return queue[0]
+
+    def pop(self, channel):
+        record = self.peek(channel)
+        if record is None:
+            raise EOFError('End of the session log (' + channel + ')')
+        return self._queues[channel].popleft()
+
+    def records(self):
+        """ Every record in file order, not to be mixed with peek() / pop()
+        """
+        chunk = self._read_chunk()
+        while chunk is not None:
+            for record in chunk:
+                yield record
+            chunk = self._read_chunk()
+
+    def close(self):
+        self._file.close()
+
+
+class CompletedFuture(object):
+    """
+    Replayed motion command, already complete
+    """
+    def __init__(self, reached=True):
+        self.reached = reached
+
+    def done(self):
+        return True
+
+    def wait(self):
+        return self.reached
+
+def is_future(value):
+    return hasattr(value, 'wait') and hasattr(value, 'done')
+
+class Recorder(object):
+    """
+    Wraps a connector or the detector and logs every attribute read and method call (arguments, result and
+    timestamp) on its channel: frames, detections, kinematics and issued controls alike.
+    Values are logged through to_plain(), motion futures as completed (they cannot be pickled).
+    log_args=False skips the call arguments, e.g. for the detector whose input frames are already logged by
+    the connector.
+    """
+    def __init__(self, target, log, channel, log_args=True):
+        self._target   = target
+        self._log      = log
+        self._channel  = channel
+        self._log_args = log_args
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            self._log.append((self._channel, 'attr', name, None, to_plain(value), time.time()))
+            return value
+
+        def call(*args, **kwargs):
+            result = value(*args, **kwargs)
+            logged = CompletedFuture() if is_future(result) else to_plain(result)
+            self._log.append((self._channel, 'call', name, to_plain((args, kwargs)) if self._log_args else None,
+                              logged, time.time()))
+            return result
+        return call
+
+class Replayer(object):
+    """
+    Stands in for a recorded connector or detector: attribute reads and calls return what was logged, in
+    order and without waiting, so a session replays as fast as the environment code runs. Logged objects come
+    back as Fields. Calls are checked
+    against the log by name, the arguments (e.g. the controls of a changed policy) are not.
+    """
+    def __init__(self, log, channel):
+        self._log     = log
+        self._channel = channel
+
+    def _pop(self, kind, name):
+        record = self._log.pop(self._channel)
+        if record[1] != kind or record[2] != name:
+            raise Exception('Replay diverged on %s: expected %s %s, got %s %s' %
+                            (self._channel, record[1], record[2], kind, name))
+        return from_plain(record[4])
+
+    def __getattr__(self, name):
+        record = self._log.peek(self._channel)
+        if record is not None and record[1] == 'attr' and record[2] == name:
+            return self._pop('attr', name)
+        return lambda *args, **kwargs: self._pop('call', name)
@@ -0,0 +1,93 @@
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+# Every measurement runs in a fresh interpreter so nothing is served from an already populated sys.modules
+IMPORT_MODULES = [
+    'numpy', 'PIL.Image', 'cv2', 'matplotlib.pyplot', 'tensorflow', 'keras',
+    'LazyModule', 'NumpyPolicy', 'ExperienceCollector',
+    'MultiRotorConnector', 'CarConnector', 'Detector',
+    'EnvironmentSeq', 'EnvironmentSeqRT', 'EnvironmentSim', 'EnvironmentRealTimeImg',
+    'DQNAgent', 'DQNAgentRealTimeImg',
+]
+
+IMPORT_SNIPPET = '''
+import time
+start = time.time()
+import {module}
+print(time.time() - start)
+'''
+
+# name -> (setup, timed statement)
+CONSTRUCT_SNIPPETS = [
+    ('DeepQAgent', '''
+import DQNAgent
+DQNAgent.DeepQAgent.SAVE_NETWORK_PATH = {tmp!r}
+DQNAgent.DeepQAgent.SAVE_SUMMARY_PATH = {tmp!r}
+''', 'DQNAgent.DeepQAgent((4, 2), 25)'),
+    ('NumpyPolicy', '''
+import numpy as np
+from NumpyPolicy import NumpyPolicy
+shapes = [(2, 64), (16, 64), (64,), (16, 32), (32,), (32, 32), (32,), (32, 25), (25,)]
+NumpyPolicy([np.zeros(shape, dtype=np.float32) for shape in shapes]).save({tmp!r} + '/policy.npz')
+''', 'NumpyPolicy.load({tmp!r} + "/policy.npz")'),
+    ('Detector', '''
+from Detector import Detector
+''', 'Detector()'),
+]
+
+CONSTRUCT_SNIPPET = '''
+import time
+{setup}
+start = time.time()
+{statement}
+print(time.time() - start)
+'''
+
+def run_snippet(snippet):
+    ''' Run a snippet in a fresh interpreter from the repository root, returns (seconds, error)
+    '''
+    root    = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen([sys.executable, '-c', snippet], cwd=root,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    if process.returncode != 0:
+        lines = err.decode('utf-8', 'replace').strip().splitlines()
+        return None, lines[-1] if lines else 'exit code %d' % process.returncode
+    return float(out.decode('utf-8').strip().splitlines()[-1]), None
+
+def report(name, seconds, error, budget):
+    if error is not None:
+        status = 'UNAVAILABLE (%s)' % error
+    elif budget is not None and seconds > budget:
+        status = 'OVER BUDGET'
+    else:
+        status = 'OK'
+    print "%-28s %10s  %s" % (name, '-' if seconds is None else '%.3f' % seconds, status)
+    return error is None and budget is not None and seconds > budget
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Import and graph construction time of the agent entry points')
+    parser.add_argument('--budget', type=float, default=None, help='Seconds allowed per module import')
+    parser.add_argument('--construct-budget', type=float, default=None, help='Seconds allowed per construction')
+    parser.add_argument('modules', nargs='*', help='Modules to import (default: all entry points)')
+    args = parser.parse_args()
+
+    over_budget = False
+    print "%-28s %10s  %s" % ('IMPORT', 'SECONDS', 'STATUS')
+    for module in args.modules or IMPORT_MODULES:
+        seconds, error = run_snippet(IMPORT_SNIPPET.format(module=module))
+        over_budget   |= report(module, seconds, error, args.budget)
+
+    if not args.modules:
+        tmp = tempfile.mkdtemp()
+        print "\n%-28s %10s  %s" % ('CONSTRUCT', 'SECONDS', 'STATUS')
+        for name, setup, statement in CONSTRUCT_SNIPPETS:
+            snippet = CONSTRUCT_SNIPPET.format(setup=setup.format(tmp=tmp), statement=statement.format(tmp=tmp))
+            seconds, error = run_snippet(snippet)
+            over_budget   |= report(name, seconds, error, args.construct_budget)
+
+    sys.exit(1 if over_budget else 0)
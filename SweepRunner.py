@@ -0,0 +1,184 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import itertools
+import subprocess
+import multiprocessing
+
+# Keys in UPPER_CASE override DeepQAgent class constants, the others configure the run itself
+DEFAULT_GRID = {
+    'LEARNING_RATE'          : [0.00025, 0.001],
+    'EXPLORATION_STEPS'      : [10000, 20000],
+    'TARGET_UPDATE_INTERVAL' : [10000],
+    'step_sizes'             : [[-40, -20, 0, 20, 40]],
+    'max_guided_eps'         : [1000, 2000],
+    'max_steps'              : [100000],
+    'seed'                   : [0],
+}
+
+RUN_DEFAULTS = {
+    'step_sizes'     : [-40, -20, 0, 20, 40],
+    'max_guided_eps' : 2000,
+    'max_steps'      : 100000,
+    'seed'           : 0,
+    'im_width'       : 1280,
+    'im_height'      : 720,
+    'threads'        : 1,
+}
+
+def expand_grid(grid):
+    ''' Cartesian product of a {key: [values]} grid, as a list of {key: value} configs
+    '''
+    keys = sorted(grid.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*[grid[key] for key in keys])]
+
+def run_config(out_dir):
+    ''' Worker side - train one config from out_dir/config.json and write out_dir/result.json
+    '''
+    with open(os.path.join(out_dir, 'config.json')) as f:
+        config = dict(RUN_DEFAULTS, **json.load(f))
+
+    import numpy as np
+    from DQNAgent import DeepQAgent, run_episodes, tf
+    from EnvironmentSeq import EnvironmentSeq
+
+    for key, value in config.items():
+        if key.isupper():
+            setattr(DeepQAgent, key, value)
+    DeepQAgent.SAVE_NETWORK_PATH = os.path.join(out_dir, 'models')
+    DeepQAgent.SAVE_SUMMARY_PATH = os.path.join(out_dir, 'logs')
+    DeepQAgent.INTRA_OP_THREADS  = config['threads']
+    DeepQAgent.INTER_OP_THREADS  = 1
+
+    random.seed(config['seed'])
+    np.random.seed(config['seed'])
+    tf.set_random_seed(config['seed'])
+
+    step_sizes = config['step_sizes']
+    agent      = DeepQAgent((DeepQAgent.STATE_LENGTH, 2), len(step_sizes) ** 2)
+    env        = EnvironmentSeq(image_shape=(config['im_height'], config['im_width']), step_sizes=step_sizes,
+                                max_guided_eps=config['max_guided_eps'], render=False)
+
+    # EnvironmentSeq and the agent print every step, millions of lines per run; errors still reach stdout.log on stderr
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        start    = time.time()
+        episodes = run_episodes(agent, env, step_sizes, max_steps=config['max_steps'])
+        wall     = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        agent.close()
+
+    rewards = [reward for reward, _ in episodes]
+    result  = {
+        'episodes'          : len(episodes),
+        'mean_reward'       : float(np.mean(rewards)) if rewards else None,
+        'mean_reward_last10': float(np.mean(rewards[-10:])) if rewards else None,
+        'steps'             : config['max_steps'],
+        'steps_per_sec'     : config['max_steps'] / wall,
+        'wall_time'         : wall,
+    }
+    with open(os.path.join(out_dir, 'result.json'), 'w') as f:
+        json.dump(result, f, indent=2)
+    print "Episodes:", result['episodes'], "mean reward (last 10):", result['mean_reward_last10'], \
+        "steps/s:", result['steps_per_sec']
+
+def aggregate(sweep_dir):
+    ''' Collect config.json / result.json of every run into one table, best last-10 reward first
+    '''
+    rows = []
+    for name in sorted(os.listdir(sweep_dir)):
+        run_dir = os.path.join(sweep_dir, name)
+        if not os.path.isfile(os.path.join(run_dir, 'config.json')):
+            continue
+        with open(os.path.join(run_dir, 'config.json')) as f:
+            row = dict(json.load(f), run=name)
+        if os.path.isfile(os.path.join(run_dir, 'result.json')):
+            with open(os.path.join(run_dir, 'result.json')) as f:
+                row.update(json.load(f))
+        rows.append(row)
+    rows.sort(key=lambda row: (row.get('mean_reward_last10') is None, -(row.get('mean_reward_last10') or 0.0)))
+
+    columns = ['run'] + sorted(set(key for row in rows for key in row.keys()) - set(['run']))
+    with open(os.path.join(sweep_dir, 'results.csv'), 'w') as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict((key, json.dumps(value) if isinstance(value, list) else value)
+                                 for key, value in row.items()))
+
+    print ' | '.join(columns)
+    for row in rows:
+        print ' | '.join(str(row.get(column, '-')) for column in columns)
+    return rows
+
+def sweep(grid, sweep_dir, parallel, threads):
+    ''' Launch every config of the grid as an isolated process, at most `parallel` at a time
+    '''
+    configs = expand_grid(grid)
+    pending = []
+    for index, config in enumerate(configs):
+        run_dir = os.path.join(sweep_dir, 'run%03d' % index)
+        if os.path.isfile(os.path.join(run_dir, 'result.json')):
+            continue # Finished in an earlier invocation
+        if not os.path.exists(run_dir):
+            os.makedirs(run_dir)
+        config = dict(config)
+        config.setdefault('threads', threads)
+        with open(os.path.join(run_dir, 'config.json'), 'w') as f:
+            json.dump(config, f, indent=2)
+        pending.append(run_dir)
+
+    print "Runs:", len(configs), "Pending:", len(pending), "Parallel:", parallel, "Threads per run:", threads
+
+    # Keep numpy / MKL / OpenMP inside each process's thread budget as well
+    env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads),
+               OPENBLAS_NUM_THREADS=str(threads))
+    root    = os.path.dirname(os.path.abspath(__file__))
+    running = []
+    while pending or running:
+        while pending and len(running) < parallel:
+            run_dir = pending.pop(0)
+            log     = open(os.path.join(run_dir, 'stdout.log'), 'w')
+            process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--run', run_dir],
+                                       cwd=root, env=env, stdout=log, stderr=subprocess.STDOUT)
+            running.append((run_dir, process, log))
+            print "Started :", run_dir
+
+        for run in list(running):
+            run_dir, process, log = run
+            if process.poll() is not None:
+                log.close()
+                running.remove(run)
+                print "Finished:", run_dir, "exit code", process.returncode
+        time.sleep(1)
+
+    return aggregate(sweep_dir)
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Parallel hyperparameter sweep over the offline sequence environments')
+    parser.add_argument('--grid', help='JSON file with {key: [values]}, defaults to DEFAULT_GRID')
+    parser.add_argument('--out', default='sweeps', help='Sweep directory, one sub-directory per run')
+    parser.add_argument('--threads', type=int, default=1, help='Intra-op threads per run')
+    parser.add_argument('--parallel', type=int, default=None, help='Concurrent runs (default: cores / threads)')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--aggregate', action='store_true', help='Only print the table of an existing sweep')
+    args = parser.parse_args()
+
+    if args.run:
+        run_config(os.path.abspath(args.run))
+    elif args.aggregate:
+        aggregate(args.out)
+    else:
+        grid = DEFAULT_GRID
+        if args.grid:
+            with open(args.grid) as f:
+                grid = json.load(f)
+        parallel = args.parallel or max(1, multiprocessing.cpu_count() // args.threads)
+        sweep(grid, os.path.abspath(args.out), parallel, args.threads)
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import threading
+import subprocess
+from contextlib import contextmanager
+from six.moves import queue
+
+from LazyModule import LazyModule
+
+tf = LazyModule('tensorflow')
+
+def current_commit():
+    try:
+        root = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=root,
+                                       stderr=subprocess.STDOUT).decode('utf-8').strip()
+    except Exception:
+        return None
+
+
+class Telemetry(object):
+    """
+    Low overhead training telemetry.
+    Scalars are written as tf.Summary protos straight to the event file by a background thread, no graph ops
+    or sess.run are involved. Counters (env steps, train steps, ...), latencies and gauges (epsilon, ...) are
+    accumulated in memory and every `interval` seconds the writer thread turns them into rates and means,
+    writes them under telemetry/ and exports them to throughput.json so training speed can be compared
+    between commits.
+    """
+    def __init__(self, logdir, writer=None, interval=10.0):
+        if not os.path.exists(logdir):
+            os.makedirs(logdir)
+        self.logdir      = logdir
+        self.interval    = interval
+        self.commit      = current_commit()
+        self.export_path = os.path.join(logdir, 'throughput.json')
+
+        self._writer    = writer if writer is not None else tf.summary.FileWriter(logdir)
+        self._queue     = queue.Queue()
+        self._lock      = threading.Lock()
+        self._counters  = {}
+        self._totals    = {}
+        self._latencies = {}
+        self._gauges    = {}
+        self._start     = time.time()
+        self._last      = self._start
+        self._stop      = threading.Event()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def scalar(self, tag, value, step):
+        """ Queue a scalar summary, returns immediately
+        """
+        self._queue.put((tag, float(value), step))
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        self._gauges[name] = value
+
+    def add_latency(self, name, seconds):
+        with self._lock:
+            total, count, worst = self._latencies.get(name, (0.0, 0, 0.0))
+            self._latencies[name] = (total + seconds, count + 1, max(worst, seconds))
+
+    @contextmanager
+    def timer(self, name):
+        start = time.time()
+        yield
+        self.add_latency(name, time.time() - start)
+
+    def snapshot(self):
+        """ Rates and latencies since the previous snapshot, counters are reset
+        """
+        now = time.time()
+        with self._lock:
+            counters, self._counters   = self._counters, {}
+            latencies, self._latencies = self._latencies, {}
+        elapsed, self._last = max(now - self._last, 1e-9), now
+
+        stats = {}
+        for name, n in counters.items():
+            self._totals[name] = self._totals.get(name, 0) + n
+            stats[name + '_per_sec'] = n / elapsed
+        for name, (total, count, worst) in latencies.items():
+            stats[name + '_ms']     = 1000.0 * total / count
+            stats[name + '_max_ms'] = 1000.0 * worst
+        for name, value in list(self._gauges.items()):
+            stats[name] = value
+        return stats
+
+    def _write(self, tag, value, step):
+        self._writer.add_summary(tf.Summary(value=[tf.Summary.Value(tag=tag, simple_value=value)]), step)
+
+    def _flush(self):
+        stats = self.snapshot()
+        step  = self._totals.get('env_steps', 0)
+        for name, value in stats.items():
+            self._write('telemetry/' + name, value, step)
+        self._writer.flush()
+
+        elapsed = time.time() - self._start
+        export  = {
+            'commit'  : self.commit,
+            'elapsed' : elapsed,
+            'totals'  : self._totals,
+            'average' : dict((name + '_per_sec', n / elapsed) for name, n in self._totals.items()),
+            'stats'   : stats,
+        }
+        with open(self.export_path + '.tmp', 'w') as f:
+            json.dump(export, f, indent=2, sort_keys=True)
+        os.rename(self.export_path + '.tmp', self.export_path)
+
+    def _run(self):
+        while not self._stop.is_set():
+            deadline = self._last + self.interval
+            while True:
+                try:
+                    record = self._queue.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if record is None: # close() wakes the thread up
+                    break
+                self._write(*record)
+                if self._stop.is_set() or time.time() >= deadline:
+                    break
+            self._flush()
+
+    def close(self):
+        self._stop.set()
+        self._queue.put(None)
+        self._thread.join()
+        while not self._queue.empty():
+            record = self._queue.get()
+            if record is not None:
+                self._write(*record)
+        self._flush()
@@ -0,0 +1,81 @@
+import os
+import sys
+import json
+import random
+import argparse
+import numpy as np
+
+# A dataset is a directory of plain .npy arrays (loaded memory mapped) plus meta.json. Rows are consecutive steps,
+# the next state of a step is the state of the following row (ReplayMemory rebuilds it the same way)
+ARRAYS = ['states', 'actions', 'rewards', 'dones', 'action_rewards', 'action_next_states']
+
+def build_dataset(path, image_shape=(720, 1280), step_sizes=[-40, -20, 0, 20, 40], passes=1, seed=0):
+    ''' Step EnvironmentSeq through every sequence with the guided-episode logic and uniform random actions,
+    and save the transitions (with the outcome of all actions, see EnvironmentSeq all_actions) under path.
+    Guided steps do not depend on the action taken, so one pass already covers every action of every frame.
+    '''
+    from EnvironmentSeq import EnvironmentSeq
+
+    random.seed(seed)
+    nb_actions = len(step_sizes) ** 2
+    env        = EnvironmentSeq(image_shape=image_shape, step_sizes=step_sizes, max_guided_eps=sys.maxsize,
+                                render=False, all_actions=True)
+    columns    = dict((name, []) for name in ARRAYS)
+
+    # EnvironmentSeq prints every step
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        for _ in range(passes * len(env._sequences)):
+            state, done = env.reset(), 0
+            while not done:
+                action = random.randrange(nb_actions)
+                offset = (step_sizes[action % len(step_sizes)], step_sizes[action // len(step_sizes)])
+                next_state, reward, done = env.step(offset)
+
+                columns['states'].append(state)
+                columns['actions'].append(action)
+                columns['rewards'].append(reward)
+                columns['dones'].append(done)
+                columns['action_rewards'].append(env.action_rewards)
+                columns['action_next_states'].append(env.action_next_states)
+                state = next_state
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    dtypes = {'actions': np.uint8, 'dones': np.uint8}
+    for name in ARRAYS:
+        np.save(os.path.join(path, name + '.npy'), np.array(columns[name], dtype=dtypes.get(name, np.float32)))
+    meta = {
+        'size'       : len(columns['actions']),
+        'nb_actions' : nb_actions,
+        'step_sizes' : step_sizes,
+        'image_shape': list(image_shape),
+        'passes'     : passes,
+        'seed'       : seed,
+    }
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    print "Transitions:", meta['size'], "->", path
+    return meta
+
+def load_dataset(path, mmap=True):
+    ''' {array name: array} of a dataset built by build_dataset(), memory mapped unless mmap is False
+    '''
+    dataset = dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None))
+                   for name in ARRAYS)
+    with open(os.path.join(path, 'meta.json')) as f:
+        dataset['meta'] = json.load(f)
+    return dataset
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Precompute the EnvironmentSeq transitions for offline training')
+    parser.add_argument('--out', default='data/transitions', help='Dataset directory')
+    parser.add_argument('--passes', type=int, default=1, help='Passes over the sequences')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    build_dataset(args.out, passes=args.passes, seed=args.seed)
@@ -27,13 +27,93 @@ def test_get_images_at_positions():
     for i,z in enumerate([-9, -6, -3, 0, 3, 6, 9]):
         for j,x in enumerate([0, 5, -5]):
             for k,y in enumerate([0, 5, -5]):
-                connector.move_to_position([x_val+x, y_val+y, z_val+z])
-                time.sleep(1)
+                connector.move_to_position([x_val+x, y_val+y, z_val+z]).wait()
                 path = 'TF_ObjectDetection/data/orig_data/' + str(count) + '.png'
                 count += 1
                 _ = connector.get_frame(path=path)
                 print "\tTest Case:", x_val+x, y_val+y, z_val+z, path
 
+def test_stand_in_rpc():
+    import socket
+    import threading
+    import msgpackrpc
+    from AirSimStandIn import StandInSim, LatencyDispatcher
+
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    loop   = msgpackrpc.Loop()
+    server = msgpackrpc.Server(LatencyDispatcher(StandInSim(64, 48), 0.01, 0.0, loop), loop=loop)
+    server.listen(msgpackrpc.Address('127.0.0.1', port))
+    thread = threading.Thread(target=server.start)
+    thread.daemon = True
+    thread.start()
+
+    client = msgpackrpc.Client(msgpackrpc.Address('127.0.0.1', port), timeout=5)
+    try:
+        assert client.call('ping')
+        client.call('takeoff')
+        assert client.call('getCollisionInfo')['has_collided'] is False
+        assert 'kinematics_estimated' in client.call('getMultirotorState')
+        assert client.call('getCarState')['collision']['has_collided'] is False
+        response = client.call('simGetImages', [{'camera_id': 3, 'image_type': 0}])[0]
+        assert len(response['image_data_uint8']) == 64 * 48 * 4
+    finally:
+        client.close()
+        server.stop()
+        thread.join()
+        server.close()
+
+def test_replay_without_airsim():
+    import sys
+    import types
+    import tempfile
+    import numpy as np
+    from SessionLog import SessionWriter, Recorder
+    from EnvironmentSeqRT import EnvironmentSeqRT
+
+    # Recorded against an AirSimClient that the replay cannot import
+    class Vector3r(object):
+        __module__ = 'AirSimClient'
+        def __init__(self, x, y, z):
+            self.x_val, self.y_val, self.z_val = x, y, z
+    airsim = types.ModuleType('AirSimClient')
+    airsim.Vector3r = Vector3r
+    sys.modules['AirSimClient'] = airsim
+
+    class Connector(object):
+        INIT_Z = -19.0
+        def capture(self):
+            return np.zeros((4, 4, 3), dtype=np.uint8), None
+        def get_position(self):
+            return airsim.Vector3r(1.0, 2.0, np.float32(-19.0))
+
+    class Detector(object):
+        def detect(self, frame):
+            return (10.0, 20.0, 5.0, 5.0)
+
+    path = tempfile.mktemp(suffix='.rtlog')
+    try:
+        session   = SessionWriter(path)
+        connector = Recorder(Connector(), session, 'drone')
+        detector  = Recorder(Detector(), session, 'detector', log_args=False)
+        for _ in range(2):
+            detector.detect(connector.capture()[0])
+        connector.get_position()
+        session.close()
+
+        sys.modules['AirSimClient'] = None # Import fails from here on
+        env = EnvironmentSeqRT(image_shape=(4, 4), replay=path)
+        assert np.allclose(env.reset(), 0.0)
+        position = env._connector.get_position()
+        assert (position.x_val, position.y_val, position.z_val) == (1.0, 2.0, -19.0)
+        env.close()
+    finally:
+        del sys.modules['AirSimClient']
+
+
 if __name__=='__main__':
 
     test_get_images_at_positions()